@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Local stand-in for httpbin.org
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Serves the httpbin endpoints used by examples, so suites can run
+    offline: /get, /post, /put, /patch, /delete, /headers, /status/<code>,
+    /response-headers, /bytes/<n>, /delay/<seconds> and /json/<items>.
+
+    Usage: python benchmarks/httpbin.py [port]
+"""
+
+import sys
+import json
+import time
+import random
+import threading
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qsl
+
+
+def parse_form(content_type, body):
+    """Get (form, files) from urlencoded or multipart request body"""
+    form = {}
+    files = {}
+    if content_type.startswith('application/x-www-form-urlencoded'):
+        form.update(parse_qsl(body.decode('utf-8', 'replace'), keep_blank_values=True))
+    elif content_type.startswith('multipart/form-data'):
+        message = BytesParser().parsebytes(
+            b'Content-Type: ' + content_type.encode() + b'\r\n\r\n' + body
+        )
+        for part in message.get_payload():
+            name = part.get_param('name', header='content-disposition')
+            value = part.get_payload(decode=True).decode('utf-8', 'replace')
+            if part.get_filename():
+                files[name] = value
+            else:
+                form[name] = value
+    return form, files
+
+
+def random_bytes(size, seed=0):
+    """Get the same pseudo random bytes for the same size"""
+    if size <= 0:
+        return b''
+    return random.Random(seed).getrandbits(8 * size).to_bytes(size, 'little')
+
+
+class Handler(BaseHTTPRequestHandler):
+    """httpbin-like request handler"""
+
+    protocol_version = 'HTTP/1.1'
+    # send headers and body in one packet, avoiding delayed ack stalls
+    wbufsize = 64 * 1024
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def send(self, status=200, body=b'', content_type='application/json', headers={}):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for (name, value) in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        # response to HEAD has headers of GET one, but no body
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def send_json(self, payload, status=200, headers={}):
+        self.send(status, json.dumps(payload).encode(), headers=headers)
+
+    def echo(self, url):
+        """Reply with request description like httpbin does"""
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        content_type = self.headers.get('Content-Type', '')
+        (form, files) = parse_form(content_type, body)
+        try:
+            parsed = json.loads(body) if content_type.startswith('application/json') else None
+        except ValueError:
+            parsed = None
+        self.send_json({
+            'args': dict(parse_qsl(url.query, keep_blank_values=True)),
+            'headers': dict(self.headers.items()),
+            'origin': self.client_address[0],
+            'url': 'http://{}{}'.format(self.headers.get('Host', ''), self.path),
+            'data': '' if (form or files) else body.decode('utf-8', 'replace'),
+            'form': form,
+            'files': files,
+            'json': parsed,
+        })
+
+    def handle_any(self):
+        url = urlparse(self.path)
+        parts = url.path.strip('/').split('/')
+        (endpoint, param) = (parts[0], parts[1] if len(parts) > 1 else None)
+        if endpoint == 'status':
+            return self.send(int(param), b'', 'text/plain')
+        if endpoint == 'headers':
+            return self.send_json({'headers': dict(self.headers.items())})
+        if endpoint == 'response-headers':
+            args = dict(parse_qsl(url.query))
+            return self.send_json(args, headers=args)
+        if endpoint == 'bytes':
+            return self.send(200, random_bytes(int(param)), 'application/octet-stream')
+        if endpoint == 'json':
+            items = [{'id': i, 'name': 'item {}'.format(i), 'on': i % 2 == 0} for i in range(int(param or 1))]
+            return self.send_json({'items': items})
+        if endpoint == 'delay':
+            time.sleep(float(param))
+        self.echo(url)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = do_HEAD = do_OPTIONS = handle_any
+
+
+class Server(object):
+    """Stand-in server running in background thread"""
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        (host, port) = self.httpd.server_address[:2]
+        return 'http://{}:{}/'.format(host, port)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+if __name__ == "__main__":
+    server = Server(port=int(sys.argv[1]) if len(sys.argv) > 1 else 8000)
+    print("Serving on {}".format(server.url))
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.httpd.server_close()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Cold start benchmark for restretto
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Measures wall time of fresh interpreters running `restretto --help`
+    and import time of restretto modules reported by `python -X importtime`.
+
+    Usage: python benchmarks/startup.py [--runs 20] [--output startup.json]
+           [--max-ms 150]
+"""
+
+import os
+import sys
+import json
+import time
+import statistics
+import subprocess
+from argparse import ArgumentParser
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules which should not be imported to show help
+HEAVY_MODULES = ('requests', 'yaml', 'jinja2', 'clint', 'aiohttp', 'asyncio')
+
+parser = ArgumentParser(description="Measure restretto cold start time")
+parser.add_argument("--runs", type=int, default=20, help="Number of interpreter runs")
+parser.add_argument("--output", default=None, help="Write results as json to this file")
+parser.add_argument(
+    "--max-ms", type=float, default=None,
+    help="Exit with error if median `restretto --help` time exceeds it")
+
+
+def run(args):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    return subprocess.run(
+        [sys.executable] + args, env=env, cwd=ROOT,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True
+    )
+
+
+def wall_times(args, runs):
+    times = []
+    for i in range(runs):
+        start = time.perf_counter()
+        run(args)
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def import_times(module):
+    """Get {module: cumulative import time, ms} reported by -X importtime"""
+    result = {}
+    for line in run(['-X', 'importtime', '-c', 'import {}'.format(module)]).stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        (_, cumulative, name) = (part.strip() for part in line[len('import time:'):].split('|'))
+        result[name] = int(cumulative) / 1000.0
+    return result
+
+
+def summary(times):
+    return {
+        'min_ms': min(times),
+        'median_ms': statistics.median(times),
+        'max_ms': max(times),
+    }
+
+
+def main(args=sys.argv[1:]):
+    arguments = parser.parse_args(args)
+    # warm up filesystem caches and bytecode
+    run(['-m', 'restretto', '--help'])
+    imports = import_times('restretto.cli')
+    results = {
+        'python': sys.version.split()[0],
+        'runs': arguments.runs,
+        'interpreter': summary(wall_times(['-c', 'pass'], arguments.runs)),
+        'help': summary(wall_times(['-m', 'restretto', '--help'], arguments.runs)),
+        'import_restretto_cli_ms': imports.get('restretto.cli'),
+        'heavy_modules_imported': sorted(m for m in HEAVY_MODULES if m in imports),
+    }
+    print(json.dumps(results, indent=2))
+    if arguments.output:
+        with open(arguments.output, 'w') as output:
+            json.dump(results, output, indent=2)
+    if arguments.max_ms and results['help']['median_ms'] > arguments.max_ms:
+        print("Median help time {:.1f}ms exceeds {:.1f}ms".format(results['help']['median_ms'], arguments.max_ms))
+        return 1
+    return 1 if results['heavy_modules_imported'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    End to end benchmark for restretto
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Generates suites of given sizes, runs them against local httpbin
+    stand-in (see httpbin.py) and measures yaml loading (cold and cached),
+    templating, requests execution and assertions. Large response bodies
+    are measured separately. Runs offline, results are written as json
+    to compare engines and caching across releases.
+
+    Usage: python benchmarks/suite.py [--sizes 10,100,1000,10000,100000]
+           [--bodies 1000000,10000000] [--engine sync] [--jobs 1]
+           [--label name] [--output suite.json]
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import tempfile
+import contextlib
+from argparse import ArgumentParser
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from httpbin import Server  # noqa: E402
+from restretto import cli, loader, stats  # noqa: E402
+from restretto.rest import Resource, Session  # noqa: E402
+
+
+# number of resources in each generated file
+RESOURCES_PER_FILE = 100
+# approximate size of item of /json/<items> response, bytes
+JSON_ITEM_SIZE = 45
+
+parser = ArgumentParser(description="Measure restretto end to end on generated suites")
+parser.add_argument(
+    "--sizes", type=lambda s: [int(v) for v in s.split(',')], default=[10, 100, 1000, 10000, 100000],
+    help="Numbers of resources in generated suites")
+parser.add_argument(
+    "--bodies", type=lambda s: [int(v) for v in s.split(',') if v], default=[1000000, 10000000],
+    help="Response body sizes, bytes")
+parser.add_argument("--engine", choices=("sync", "async"), default="sync", help="Execution engine")
+parser.add_argument("-j", "--jobs", type=cli.positive, default=1, help="Sessions run concurrently")
+parser.add_argument("--label", default=None, help="Name of this run, like release or branch")
+parser.add_argument("--output", default=None, help="Write results as json to this file")
+
+
+def generated_resource(index):
+    """Get resource spec, kinds of requests and assertions alternate"""
+    kind = index % 4
+    if kind == 0:
+        return {
+            'title': 'Get {}'.format(index),
+            'get': '/get?page={}&user={{{{user}}}}'.format(index),
+            'expect': [
+                {'status': 200},
+                {'body': 'json', 'property': 'json.args.user', 'is': '{{user}}'},
+            ],
+        }
+    if kind == 1:
+        return {
+            'title': 'Post {}'.format(index),
+            'post': '/post',
+            'json': {'index': index, 'user': '{{user}}', 'tags': ['a', 'b', '{{token}}']},
+            'vars': {'received': 'json.json.user'},
+            'expect': [
+                {'body': 'json', 'property': 'json.json.index', 'is': index},
+            ],
+        }
+    if kind == 2:
+        return {
+            'title': 'Headers {}'.format(index),
+            'get': '/response-headers?X-Token={{token}}',
+            'headers': {'X-User': '{{received}}'},
+            'expect': [
+                {'status': '2xx'},
+                {'header': 'X-Token', 'is': '{{token}}'},
+            ],
+        }
+    return {
+        'title': 'Status {}'.format(index),
+        'get': '/status/204',
+        'expect': [{'status': [200, 204]}],
+    }
+
+
+def generate(directory, size, base_uri):
+    """Write suite of size resources split into files, returns number of files"""
+    import yaml
+    files = 0
+    for start in range(0, size, RESOURCES_PER_FILE):
+        spec = {
+            'title': 'Generated {}'.format(start // RESOURCES_PER_FILE),
+            'baseUri': base_uri,
+            'headers': {'Accept': 'application/json'},
+            'vars': {'user': 'bench', 'token': 'secret', 'received': 'bench'},
+            'resources': [
+                generated_resource(i) for i in range(start, min(size, start + RESOURCES_PER_FILE))
+            ],
+        }
+        path = os.path.join(directory, 'suite-{:05d}.yml'.format(files))
+        with open(path, 'w') as target:
+            yaml.safe_dump(spec, target, default_flow_style=False)
+        files += 1
+    return files
+
+
+def timed(fn, *args):
+    """Get (result, seconds) of fn call"""
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def render_all(sessions):
+    """Apply session context to every resource, like run does"""
+    for test_session in sessions:
+        for resource in test_session.resources:
+            if isinstance(resource, Resource):
+                resource.prepare(test_session.baseUri, test_session.context)
+
+
+def run_all(sessions, arguments):
+    """Run sessions the way cli does, output is discarded, returns records"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        if arguments.engine == "async":
+            import asyncio
+            return asyncio.run(cli.run_async(sessions, arguments))
+        if arguments.jobs > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=arguments.jobs) as pool:
+                return [r for (o, r) in pool.map(lambda s: cli.run_buffered(s, arguments), sessions)]
+        return [cli.run_session(s, arguments) for s in sessions]
+
+
+def phase_totals(sessions):
+    """Sum resources timings by phase, ms"""
+    totals = {}
+    for test_session in sessions:
+        for resource in test_session.resources:
+            for (phase, value) in resource.timings.items():
+                totals[phase] = totals.get(phase, 0.0) + value
+    return {phase: value * 1000 for (phase, value) in totals.items()}
+
+
+def run_results(sessions, arguments):
+    (records, elapsed) = timed(run_all, sessions, arguments)
+    requests = sum(len(s.resources) for s in sessions)
+    result = {
+        'run_ms': elapsed * 1000,
+        'requests_per_s': requests / elapsed if elapsed else None,
+        'phases_ms': phase_totals(sessions),
+    }
+    result.update((outcome, sum(r[outcome] for r in records)) for outcome in stats.OUTCOMES)
+    return result
+
+
+def bench_suite(size, base_uri, arguments, workdir):
+    directory = os.path.join(workdir, 'suite-{}'.format(size))
+    cache_dir = os.path.join(workdir, 'cache-{}'.format(size))
+    os.makedirs(directory)
+    files = generate(directory, size, base_uri)
+    (sessions, load_time) = timed(loader.load, directory)
+    # first run fills cache, second one reads it
+    loader.load(directory, cache_dir)
+    (sessions, cached_load_time) = timed(loader.load, directory, cache_dir)
+    (_, templating_time) = timed(render_all, sessions)
+    result = {
+        'resources': size,
+        'files': files,
+        'load_ms': load_time * 1000,
+        'cached_load_ms': cached_load_time * 1000,
+        'templating_ms': templating_time * 1000,
+    }
+    result.update(run_results(sessions, arguments))
+    return result
+
+
+def bench_body(size, base_uri, arguments):
+    """Run session receiving and posting json bodies of about size bytes"""
+    items = max(1, size // JSON_ITEM_SIZE)
+    payload = {'items': [{'id': i, 'name': 'item {}'.format(i), 'on': i % 2 == 0} for i in range(items)]}
+    spec = {
+        'title': 'Body of {} bytes'.format(size),
+        'baseUri': base_uri,
+        'vars': {'items': items, 'payload': payload},
+        'resources': [
+            {
+                'title': 'Get large json',
+                'get': '/json/{{items}}',
+                'expect': [{'body': 'json', 'property': 'json.items.0.name', 'is': 'item 0'}],
+            },
+            {
+                'title': 'Post large json',
+                'post': '/post',
+                'json': '{{payload}}',
+                'expect': [{'body': 'json', 'property': 'json.json.items.1.id', 'is': 1}],
+            },
+            {
+                'title': 'Get large text',
+                'get': '/bytes/{}'.format(size),
+                'expect': [{'status': 200}],
+            },
+        ],
+    }
+    sessions = [Session(spec)]
+    result = {'bytes': size}
+    result.update(run_results(sessions, arguments))
+    return result
+
+
+def main(args=sys.argv[1:]):
+    arguments = parser.parse_args(args)
+    # options used by cli runners
+    run_arguments = cli.parser.parse_args(['-', '--engine', arguments.engine, '-j', str(arguments.jobs)])
+    results = {
+        'label': arguments.label,
+        'python': sys.version.split()[0],
+        'engine': arguments.engine,
+        'jobs': arguments.jobs,
+        'suites': [],
+        'bodies': [],
+    }
+    workdir = tempfile.mkdtemp(prefix='restretto-bench-')
+    try:
+        with Server() as server:
+            for size in arguments.sizes:
+                results['suites'].append(bench_suite(size, server.url, run_arguments, workdir))
+                print(json.dumps(results['suites'][-1]), file=sys.stderr)
+            for size in arguments.bodies:
+                results['bodies'].append(bench_body(size, server.url, run_arguments))
+                print(json.dumps(results['bodies'][-1]), file=sys.stderr)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print(json.dumps(results, indent=2))
+    if arguments.output:
+        with open(arguments.output, 'w') as output:
+            json.dump(results, output, indent=2)
+    failed = [r for r in results['suites'] + results['bodies'] if r['failed'] or r['errors']]
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
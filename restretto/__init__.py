@@ -5,8 +5,29 @@
     ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 """
 
-from . import assertions
-from . import errors
-from . import utils
-from .rest import Resource, Session
-from .loader import load
+import importlib
+
+
+# submodules and names are imported on first access, so tools importing
+# restretto (like cli showing help) don't pay for requests, yaml and jinja2
+_LAZY = {
+    'assertions': ('.assertions', None),
+    'errors': ('.errors', None),
+    'utils': ('.utils', None),
+    'Resource': ('.rest', 'Resource'),
+    'Session': ('.rest', 'Session'),
+    'load': ('.loader', 'load'),
+}
+
+__all__ = list(_LAZY)
+
+
+def __getattr__(name):
+    if name not in _LAZY:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    (module, attr) = _LAZY[name]
+    value = importlib.import_module(module, __name__)
+    if attr:
+        value = getattr(value, attr)
+    globals()[name] = value
+    return value
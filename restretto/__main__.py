@@ -1,7 +1,8 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import sys
 from . import cli
 
 if __name__ == "__main__":
-    return cli.main()
+    sys.exit(cli.main())
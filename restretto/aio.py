@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Asyncio HTTP engine for restretto
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Requires aiohttp to be installed.
+"""
+
+import time
+import json as jsonlib
+import aiohttp
+from .rest import DRAIN_LIMIT
+
+
+class Response(object):
+    """Read aiohttp response, looking like requests.Response for assertions"""
+
+    def __init__(self, response, content, timings=None):
+        # time to first byte and body transfer time
+        self.timings = timings or {}
+        self.status_code = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+        self.url = str(response.url)
+        self.encoding = response.charset or 'utf-8'
+        self.content = content
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    def __bool__(self):
+        return self.ok
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding, errors='replace')
+
+    def json(self):
+        return jsonlib.loads(self.text)
+
+    def iter_content(self, chunk_size=1):
+        for offset in range(0, len(self.content), chunk_size):
+            yield self.content[offset:offset + chunk_size]
+
+
+def encode_params(params):
+    """Get query params as (name, value) pairs, encoded as requests does:
+    None values are skipped, lists give repeated names, values are strings
+    """
+    if not isinstance(params, dict):
+        return params
+    pairs = []
+    for (name, value) in params.items():
+        values = value if isinstance(value, (list, tuple)) else [value]
+        pairs.extend((str(name), str(v)) for v in values if v is not None)
+    return pairs
+
+
+class HttpSession(object):
+    """HTTP session with own headers and cookies, using shared connection pool"""
+
+    def __init__(self, client, headers=None, verify=False):
+        self.client = client
+        self.headers = dict(headers or {})
+        self.verify = verify
+        self._session = None
+
+    @property
+    def session(self):
+        # should be created inside running event loop
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=self.client.connector, connector_owner=False,
+                headers=self.headers,
+                # keep cookies of IP address hosts too, as requests does
+                cookie_jar=aiohttp.CookieJar(unsafe=True)
+            )
+        return self._session
+
+    async def request(self, method, url, headers=None, params=None, data=None, json=None, files=None,
+                      stream=False, skip_body=False):
+        """Make request, arguments are the same as for requests.Session.request
+
+        Response body is read, so stream is ignored, unless skip_body is set:
+        then body is read only up to limit, to reuse connection, and
+        response content is empty.
+        """
+        if files:
+            # multipart form with files and form data, if any
+            form = aiohttp.FormData()
+            for (name, value) in (data or {}).items():
+                form.add_field(name, str(value))
+            for (name, fileobj) in files:
+                form.add_field(name, fileobj)
+            data = form
+        kwargs = {'headers': headers, 'params': encode_params(params), 'data': data}
+        if json is not None:
+            kwargs['json'] = json
+        if not self.verify:
+            kwargs['ssl'] = False
+        start = time.perf_counter()
+        async with self.session.request(method.upper(), url, **kwargs) as response:
+            received = time.perf_counter()
+            if not skip_body:
+                content = await response.read()
+            else:
+                length = response.content_length
+                if method.upper() != 'HEAD' and length is not None and length > DRAIN_LIMIT:
+                    response.close()
+                else:
+                    # body of unknown length is read up to limit too
+                    drained = 0
+                    while drained <= DRAIN_LIMIT:
+                        chunk = await response.content.read(DRAIN_LIMIT)
+                        if not chunk:
+                            break
+                        drained += len(chunk)
+                    else:
+                        response.close()
+                content = b''
+            timings = {'ttfb': received - start, 'transfer': time.perf_counter() - received}
+            return Response(response, content, timings)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+class Client(object):
+    """Asyncio HTTP client, sessions created by it share the connection pool"""
+
+    def __init__(self, limit=100, limit_per_host=0, keep_alive=True):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keep_alive = keep_alive
+        self._connector = None
+
+    @property
+    def connector(self):
+        # should be created inside running event loop
+        if self._connector is None:
+            self._connector = aiohttp.TCPConnector(
+                limit=self.limit, limit_per_host=self.limit_per_host,
+                force_close=not self.keep_alive
+            )
+        return self._connector
+
+    def session(self, headers=None, verify=False):
+        return HttpSession(self, headers, verify)
+
+    async def close(self):
+        if self._connector is not None:
+            await self._connector.close()
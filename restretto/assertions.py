@@ -2,20 +2,67 @@
 # -*- coding: utf-8 -*-
 
 
-from fnmatch import fnmatch
-from .utils import json_path
-from .errors import ExpectError
+import re
+from fnmatch import translate
+from .utils import compile_path, is_templated, ContextTemplate
+from .errors import ExpectError, ParseError
+
+
+# status pattern, like 4xx or 20x
+STATUS_RANGE = re.compile(r'^\d*x+$')
+
+
+class Statuses(object):
+    """Expected status codes, given as code, pattern like 4xx or list of them"""
+
+    def __init__(self, expected):
+        codes = set()
+        ranges = []
+        patterns = []
+        for item in (expected if isinstance(expected, list) else [expected]):
+            item = str(item).strip()
+            if item.isdigit():
+                codes.add(int(item))
+            elif STATUS_RANGE.match(item):
+                prefix = item.rstrip('x')
+                scale = 10 ** (len(item) - len(prefix))
+                start = int(prefix or 0) * scale
+                ranges.append(range(start, start + scale))
+            else:
+                patterns.append(re.compile(translate(item.replace('x', '?'))))
+        self.codes = frozenset(codes)
+        self.ranges = tuple(ranges)
+        self.patterns = tuple(patterns)
+
+    def __contains__(self, code):
+        return code in self.codes \
+            or any(code in r for r in self.ranges) \
+            or any(p.match(str(code)) for p in self.patterns)
 
 
 class ResponseTest(object):
 
     message = "Bad response ({0} {1})"
+    # test is done only after response body is downloaded
+    after_download = False
+    # render templates to native types or parse rendered as yaml
+    native = True
 
     def expect(self, statement, message=''):
         if not statement:
             raise ExpectError(message)
 
-    def test(self, response):
+    def template(self, value):
+        """Get compiled operand, None if it's not templated"""
+        return ContextTemplate(value, self.native) if is_templated(value) else None
+
+    def render(self, template, value, context=None):
+        """Apply context to operand, if it's templated"""
+        if template is None or context is None:
+            return value
+        return template.render(context)
+
+    def test(self, response, context=None):
         self.expect(response, self.message.format(response.status_code, response.reason))
 
     def assert_is(self, item, value):
@@ -45,87 +92,130 @@ class ResponseTest(object):
             "Length mismatch: got {} intead of expected {}".format(len(item), value)
         )
 
-    def assert_statements(self, statements, item):
-        # assert all conditions are satisfied
+    def assert_unknown(self, cond):
+        def check(item, value):
+            raise ParseError("Unknown assertion: {}".format(cond))
+        return check
+
+    def compile_statements(self, statements):
+        """Get (check function, operand, operand template or None) for each condition"""
+        checks = []
         for (cond, value) in statements.items():
-            assert_fn = 'assert_{}'.format(cond)
-            getattr(self, assert_fn)(item, value)
+            check = getattr(self, 'assert_{}'.format(cond), None) or self.assert_unknown(cond)
+            checks.append((check, value, self.template(value)))
+        return tuple(checks)
+
+    def assert_statements(self, checks, item, context=None):
+        # assert all conditions are satisfied
+        for (check, value, template) in checks:
+            check(item, self.render(template, value, context))
 
 
 class StatusCodeTest(ResponseTest):
 
     message = "Unexpected status ({0} instead of {1})"
 
-    def __init__(self, status):
-        # convert int code to str
-        self.expected = str(status) if isinstance(status, int) else status
-
-    def test(self, response):
-        if isinstance(self.expected, str):
-            self.expect(
-                fnmatch(str(response.status_code), self.expected.replace('x', '?')),
-                self.message.format(response.status_code, self.expected)
-            )
-        else:
-            # treat as list of possible statuses
-            self.expect(
-                str(response.status_code) in self.expected,
-                self.message.format(response.status_code, self.expected)
-            )
+    def __init__(self, status, native=True):
+        self.native = native
+        self.expected = status
+        # templated status is known only when testing
+        self.templated = self.template(status)
+        self.statuses = None if self.templated else Statuses(status)
+
+    def test(self, response, context=None):
+        (expected, statuses) = (self.expected, self.statuses)
+        if self.templated:
+            expected = self.render(self.templated, expected, context)
+            statuses = Statuses(expected)
+        self.expect(
+            response.status_code in statuses,
+            self.message.format(response.status_code, expected)
+        )
 
 
 class ResponsePropertyTest(ResponseTest):
 
-    def __init__(self, name, statements={}):
+    def __init__(self, name, statements={}, native=True):
+        self.native = native
         self.name = name
-        self.statements = statements
+        self.name_templated = self.template(name)
+        self.checks = self.compile_statements(statements)
+
+    def get_name(self, context=None):
+        return self.render(self.name_templated, self.name, context)
 
 
 class HeaderTest(ResponsePropertyTest):
 
-    def test(self, response):
-        header = response.headers.get(self.name, None)
-        self.expect(header, "Header not found: {}".format(self.name))
-        self.assert_statements(self.statements, header)
+    def test(self, response, context=None):
+        name = self.get_name(context)
+        header = response.headers.get(name, None)
+        self.expect(header, "Header not found: {}".format(name))
+        self.assert_statements(self.checks, header, context)
 
 
 class BodyTest(ResponsePropertyTest):
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
+    def __init__(self, name, statements={}, native=True):
+        statements = dict(statements)
         # pop property definition, if available
-        self.prop = self.statements.pop('property', None)
+        self.prop = statements.pop('property', None)
+        super().__init__(name, statements, native)
+        self.prop_templated = self.template(self.prop)
+        self.path = compile_path(self.prop) if self.prop and not self.prop_templated else None
 
-    def test(self, response):
+    def test(self, response, context=None):
         data = None
-        if self.name == 'text':
+        name = self.get_name(context)
+        if name == 'text':
             data = response.text
-        elif self.name == 'json' and not self.prop:
+        elif name == 'json' and not self.prop:
             data = response.json()
-        elif self.name == 'json' and self.prop:
+        elif name == 'json' and self.prop:
             # get required property value
-            data = json_path(self.prop, {'json': response.json()})
-        self.assert_statements(self.statements, data)
+            path = compile_path(self.render(self.prop_templated, self.prop, context)) if self.prop_templated else self.path
+            data = path.get({'json': response.json()})
+        if not self.checks and not self.prop:
+            # check if body not empty
+            self.expect(data, "Response body is empty")
+        self.assert_statements(self.checks, data, context)
+
+
+class DownloadTest(ResponsePropertyTest):
+
+    after_download = True
+
+    def test(self, response, context=None):
+        downloaded = getattr(response, 'downloaded', None)
+        self.expect(downloaded, "Response body is not downloaded")
+        self.expect(self.name in ('size', 'checksum'), "Unknown download property: {}".format(self.name))
+        value = downloaded[self.name]
+        self.expect(value is not None, "Download {} is not calculated".format(self.name))
+        self.assert_statements(self.checks, value, context)
 
 
 class Assert(object):
+    """Compiled assertions, only templated operands are rendered when testing"""
 
-    def __init__(self, statements=[]):
-        self.statements = []
+    def __init__(self, statements=[], native=True):
+        self.native = native
+        tests = []
         self._has_status_test = False
         if not statements:
             # assume default simple check
-            self.statements = [ResponseTest()]
+            tests = [ResponseTest()]
         else:
             for spec in statements:
-                self.statements.append(self.statement(spec))
+                tests.append(self.statement(spec))
             if not self._has_status_test:
                 # add default test for status_code to be ok
-                self.statements.insert(0, ResponseTest())
+                tests.insert(0, ResponseTest())
+        self.statements = tuple(tests)
 
-    def test(self, response):
+    def test(self, response, context=None, after_download=False):
         for stmt in self.statements:
-            stmt.test(response)
+            if stmt.after_download == after_download:
+                stmt.test(response, context)
         return True
 
     def statement(self, spec):
@@ -133,8 +223,10 @@ class Assert(object):
         spec = dict(spec)
         if 'status' in spec:
             self._has_status_test = True
-            return StatusCodeTest(spec['status'])
+            return StatusCodeTest(spec['status'], self.native)
         if 'header' in spec:
-            return HeaderTest(spec.pop('header'), spec)
+            return HeaderTest(spec.pop('header'), spec, self.native)
         if 'body' in spec:
-            return BodyTest(spec.pop('body'), spec)
+            return BodyTest(spec.pop('body'), spec, self.native)
+        if 'download' in spec:
+            return DownloadTest(spec.pop('download'), spec, self.native)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Benchmarking support for restretto
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Runs test sessions repeatedly by concurrent virtual users and reports
+    latency percentiles per resource.
+"""
+
+import sys
+import time
+import threading
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from . import load, pools
+from .cli import options, positive
+from .errors import ExpectError
+from .rest import Wait
+from .stats import ResourceStats
+
+
+parser = ArgumentParser(prog="restretto bench", description="Run test sessions as load tests")
+parser.add_argument("path", help="path to look for tests (file or directory)")
+parser.add_argument(
+    "-c", "--concurrency", type=positive, default=1,
+    help="Number of concurrent virtual users")
+parser.add_argument(
+    "-n", "--iterations", type=positive, default=None,
+    help="Total number of session runs (one per virtual user by default)")
+parser.add_argument(
+    "-d", "--duration", type=float, default=None,
+    help="Run sessions for given number of seconds")
+parser.add_argument(
+    "--vars", action="store", type=options,
+    help="Context variables as var1=val1,var2=val2")
+
+
+class Schedule(object):
+    """Gives out session runs to virtual users, by count or until deadline"""
+
+    def __init__(self, iterations=None, duration=None):
+        self.remaining = iterations
+        self.deadline = time.monotonic() + duration if duration else None
+        self.lock = threading.Lock()
+
+    def next(self):
+        """Returns True if one more session run should be made"""
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            return False
+        if self.remaining is None:
+            return True
+        with self.lock:
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            return True
+
+
+def virtual_user(test_session, context, schedule):
+    """Run session until schedule allows, returns stats for each resource
+
+    Virtual user has its own fork of session, so context and cookies are
+    not shared with other users, while parsed resources are. Context is
+    reset before each run.
+    """
+    session = test_session.fork(context)
+    initial = dict(session.context)
+    stats = [ResourceStats(resource.title) for resource in session.resources]
+    while schedule.next():
+        session.context = dict(initial)
+        for (resource, resource_stats) in zip(session.resources, stats):
+            result = session.execute(resource, context)
+            if isinstance(resource, Wait):
+                continue
+            if result.error is None:
+                outcome = 0
+            elif isinstance(result.error, ExpectError):
+                outcome = 1
+            else:
+                outcome = 2
+            resource_stats.record(result.timings['wall'], outcome)
+    return stats
+
+
+def bench(test_session, concurrency=1, iterations=None, duration=None, context=None):
+    """Run session by concurrent virtual users, returns (elapsed, stats) for each resource"""
+    if iterations is None and duration is None:
+        iterations = concurrency
+    schedule = Schedule(iterations, duration)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        users = [
+            pool.submit(virtual_user, test_session, dict(context or {}), schedule)
+            for i in range(concurrency)
+        ]
+        results = [user.result() for user in users]
+    elapsed = time.perf_counter() - start
+    stats = results[0]
+    for other in results[1:]:
+        for (resource_stats, other_stats) in zip(stats, other):
+            resource_stats.merge(other_stats)
+    waits = [isinstance(resource, Wait) for resource in test_session.resources]
+    return elapsed, [s for (s, wait) in zip(stats, waits) if not wait]
+
+
+def ms(value):
+    return '-' if value is None else '{:.1f}'.format(value * 1000)
+
+
+def report(test_session, elapsed, stats, out=None):
+    out = out or sys.stdout
+    hdr = "Bench session: {} ({:.2f}s)".format(test_session.title, elapsed)
+    print(hdr, file=out)
+    print('-' * len(hdr), file=out)
+    row = "{:<40} {:>8} {:>9} {:>7} {:>9} {:>9} {:>9} {:>9}"
+    print(row.format("Resource", "Count", "Req/s", "Err%", "p50 ms", "p90 ms", "p99 ms", "Max ms"), file=out)
+    for resource_stats in stats:
+        latency = resource_stats.latency
+        print(row.format(
+            resource_stats.title[:40],
+            resource_stats.count,
+            '{:.1f}'.format(resource_stats.count / elapsed if elapsed else 0.0),
+            '{:.1f}'.format(resource_stats.error_rate * 100),
+            ms(latency.percentile(50)),
+            ms(latency.percentile(90)),
+            ms(latency.percentile(99)),
+            ms(latency.max),
+        ), file=out)
+    print("", file=out)
+
+
+def main(args=sys.argv[1:]):
+    arguments = parser.parse_args(args)
+
+    # every virtual user keeps a connection to each host, sessions created by loader use them
+    pools.configure(max_connections=max(10, arguments.concurrency))
+    sessions = load(arguments.path)
+    if not sessions:
+        print("No test sessions found, exiting")
+        sys.exit(1)
+
+    failed = False
+    for test_session in sessions:
+        (elapsed, stats) = bench(
+            test_session, arguments.concurrency, arguments.iterations,
+            arguments.duration, arguments.vars
+        )
+        report(test_session, elapsed, stats)
+        failed = failed or any(s.failed or s.errors for s in stats)
+    return 1 if failed else 0
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Parsed specs cache for restretto
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+
+import os
+import pickle
+import hashlib
+import tempfile
+
+
+# bump to invalidate caches written by previous versions
+CACHE_VERSION = 1
+
+
+def read_stamped(path):
+    """Get file content and its stamp: (mtime, size, content hash)"""
+    # stat before reading, so changes made while reading are not missed
+    stat = os.stat(path)
+    with open(path, 'rb') as source:
+        content = source.read()
+    return content, (stat.st_mtime_ns, stat.st_size, hashlib.sha1(content).hexdigest())
+
+
+class SpecCache(object):
+    """On-disk cache of parsed specs, keyed by file path
+
+    Entry is valid while spec file and all files it depends on (var files)
+    are unchanged: same mtime and size, or same content hash.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _entry_path(self, path):
+        key = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()
+        return os.path.join(self.directory, key + '.pickle')
+
+    @staticmethod
+    def _unchanged(path, known):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        (mtime, size, digest) = known
+        if (stat.st_mtime_ns, stat.st_size) == (mtime, size):
+            return True
+        # touched, but may be not changed
+        return stat.st_size == size and read_stamped(path)[1][2] == digest
+
+    def get(self, path):
+        """Get (found, spec) for path"""
+        try:
+            with open(self._entry_path(path), 'rb') as source:
+                entry = pickle.load(source)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return (False, None)
+        if entry.get('version') != CACHE_VERSION or entry.get('path') != os.path.abspath(path):
+            return (False, None)
+        for (dependency, known) in entry['files'].items():
+            if not self._unchanged(dependency, known):
+                return (False, None)
+        return (True, entry['spec'])
+
+    def put(self, path, spec, files):
+        """Store spec parsed from path, files are {path: stamp} of all its sources"""
+        entry = {
+            'version': CACHE_VERSION,
+            'path': os.path.abspath(path),
+            'files': {os.path.abspath(f): known for (f, known) in files.items()},
+            'spec': spec,
+        }
+        # write atomically, cache can be shared by concurrent runs
+        (fd, tmp_path) = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, 'wb') as target:
+            pickle.dump(entry, target, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self._entry_path(path))
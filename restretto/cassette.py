@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Recorded HTTP responses for restretto
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Cassette file is a sequence of responses, each one is a json line
+    with status, reason, url and headers followed by raw body, then index
+    of responses by request key and fixed size footer pointing to index:
+
+        MAGIC | response ... | index json | index offset (8 bytes) | MAGIC
+
+    Replay maps file to memory and reads only responses requested.
+"""
+
+import io
+import json
+import mmap
+import struct
+import hashlib
+import threading
+from email.message import Message
+from .errors import ParseError
+
+
+MAGIC = b'RESTRETTO-CASSETTE-1\n'
+FOOTER = struct.Struct('>Q')
+
+
+def request_key(request):
+    """Get key of prepared request: hash of method, url and body"""
+    body = request.body or b''
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    elif not isinstance(body, bytes):
+        # streamed body can't be read twice, match by method and url only
+        body = b''
+    content_type = request.headers.get('Content-Type', '')
+    if content_type.startswith('multipart/') and 'boundary=' in content_type:
+        # boundary is random for each request
+        boundary = content_type.split('boundary=', 1)[1].split(';')[0].strip('"')
+        body = body.replace(boundary.encode(), b'')
+    digest = hashlib.sha1(request.method.upper().encode())
+    digest.update(b' ' + request.url.encode() + b'\n')
+    digest.update(body)
+    return digest.hexdigest()
+
+
+class ReplayedRaw(io.BytesIO):
+    """Stands for urllib3 response, so cookies are extracted from headers"""
+
+    def __init__(self, headers):
+        super(ReplayedRaw, self).__init__()
+        self.msg = Message()
+        for (name, value) in headers:
+            self.msg[name] = value
+        self._original_response = self
+
+    def release_conn(self):
+        pass
+
+
+class Cassette(object):
+    """Responses recorded to file or replayed from it
+
+    Same request made several times gets its recorded responses in order,
+    the last one is repeated when they are exhausted.
+    """
+
+    def __init__(self, path, mode='replay'):
+        if mode not in ('record', 'replay'):
+            raise ValueError('Unknown cassette mode: {}'.format(mode))
+        self.path = path
+        self.mode = mode
+        self.lock = threading.Lock()
+        # {request key: [(offset, length), ...]}
+        self.index = {}
+        if mode == 'record':
+            self.file = open(path, 'wb')
+            self.file.write(MAGIC)
+            self.map = None
+        else:
+            self.file = open(path, 'rb')
+            try:
+                self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+                self._read_index()
+            except Exception:
+                self.file.close()
+                raise
+        # number of responses replayed by request key
+        self.replayed = {}
+
+    def _read_index(self):
+        tail = len(MAGIC) + FOOTER.size
+        if len(self.map) < len(MAGIC) + tail or self.map[:len(MAGIC)] != MAGIC \
+                or self.map[-len(MAGIC):] != MAGIC:
+            raise ParseError('Not a complete cassette file: {}'.format(self.path))
+        (offset, ) = FOOTER.unpack(self.map[-tail:-len(MAGIC)])
+        self.index = json.loads(self.map[offset:-tail].decode('utf-8'))
+
+    def record(self, request, response):
+        """Append response to request, response body is read"""
+        raw_headers = getattr(response.raw, 'headers', None) or response.headers
+        headers = list(raw_headers.iteritems() if hasattr(raw_headers, 'iteritems') else raw_headers.items())
+        head = json.dumps({
+            'status': response.status_code,
+            'reason': response.reason,
+            'url': response.url,
+            'headers': headers,
+        }).encode('utf-8')
+        body = response.content or b''
+        with self.lock:
+            offset = self.file.tell()
+            self.file.write(head + b'\n' + body)
+            self.index.setdefault(request_key(request), []).append((offset, len(head) + 1 + len(body)))
+
+    def replay(self, request):
+        """Get response recorded for request, None if there is no such one"""
+        key = request_key(request)
+        entries = self.index.get(key)
+        if not entries:
+            return None
+        with self.lock:
+            number = self.replayed.get(key, 0)
+            self.replayed[key] = number + 1
+        (offset, length) = entries[min(number, len(entries) - 1)]
+        head_end = self.map.find(b'\n', offset, offset + length)
+        head = json.loads(self.map[offset:head_end].decode('utf-8'))
+        from requests.models import Response
+        from requests.structures import CaseInsensitiveDict
+        from requests.utils import get_encoding_from_headers
+        from datetime import timedelta
+        response = Response()
+        response.status_code = head['status']
+        response.reason = head['reason']
+        response.url = head['url']
+        response.headers = CaseInsensitiveDict()
+        for (name, value) in head['headers']:
+            if name in response.headers:
+                value = '{}, {}'.format(response.headers[name], value)
+            response.headers[name] = value
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.raw = ReplayedRaw(head['headers'])
+        # only this response body is copied from mapped file
+        response._content = self.map[head_end + 1:offset + length]
+        response._content_consumed = True
+        response.request = request
+        response.elapsed = timedelta(0)
+        return response
+
+    def close(self):
+        if self.file.closed:
+            return
+        if self.mode == 'record':
+            with self.lock:
+                offset = self.file.tell()
+                self.file.write(json.dumps(self.index).encode('utf-8'))
+                self.file.write(FOOTER.pack(offset) + MAGIC)
+        else:
+            self.map.close()
+        self.file.close()
+
+    def adapter(self, adapter):
+        """Get transport adapter recording responses got by adapter or replaying them"""
+        from requests.adapters import BaseAdapter
+        from requests.exceptions import ConnectionError
+        cassette = self
+
+        class CassetteAdapter(BaseAdapter):
+
+            def send(self, request, **kwargs):
+                if cassette.mode == 'record':
+                    response = adapter.send(request, **kwargs)
+                    cassette.record(request, response)
+                    return response
+                response = cassette.replay(request)
+                if response is None:
+                    raise ConnectionError(
+                        'No recorded response for {} {}'.format(request.method, request.url),
+                        request=request
+                    )
+                response.connection = self
+                return response
+
+            def close(self):
+                adapter.close()
+
+        return CassetteAdapter()
@@ -6,11 +6,27 @@
 """
 
 
+import io
 import sys
+import time
 from argparse import ArgumentParser, ArgumentTypeError
-from . import load
+from . import pools
+from .shard import shard
+from .stats import OUTCOMES
 from .errors import ExpectError
-from clint.textui import colored, puts
+from .utils import JSON_DECODERS, set_json_decoder
+
+
+def load(path, cache_dir=None):
+    """Load test sessions, loader is imported when required"""
+    from .loader import load
+    return load(path, cache_dir)
+
+
+def paint(color, text):
+    """Get colored text, clint imported when output is done"""
+    from clint.textui import colored
+    return getattr(colored, color)(text)
 
 
 def options(encoded):
@@ -27,7 +43,22 @@ def options(encoded):
     return opts
 
 
-parser = ArgumentParser(description="REST resources/endpoints testing tool")
+def positive(encoded):
+    """Returns positive int parsed from string"""
+    try:
+        value = int(encoded)
+        if value < 1:
+            raise ValueError
+    except ValueError:
+        raise ArgumentTypeError("expected positive integer, got {}".format(encoded))
+    return value
+
+
+parser = ArgumentParser(
+    description="REST resources/endpoints testing tool",
+    epilog="Use 'restretto bench --help' for load testing options, "
+           "'restretto merge --help' for merging reports of shards"
+)
 parser.add_argument("path", help="path to look for tests (file or directory)")
 #parser.add_argument("--xunit", dest="xunit_dir", default=None,
 #                    help="output xunit reports to this dir")
@@ -40,47 +71,406 @@ parser.add_argument(
     "--debug-errors", action="store_true",
     help="Open ipdb (should be isntalled) debugger on errors"
 )
+parser.add_argument(
+    "-j", "--jobs", type=positive, default=1,
+    help="Number of test sessions to run concurrently"
+)
+parser.add_argument(
+    "--parallel-resources", type=positive, default=1,
+    help="Number of independent resources of a session to run concurrently"
+)
+parser.add_argument(
+    "--engine", choices=("sync", "async"), default="sync",
+    help="Execution engine: requests based or asyncio based (requires aiohttp)"
+)
+parser.add_argument(
+    "--json-decoder", choices=JSON_DECODERS, default=None,
+    help="Module to decode json responses with (fastest available by default)"
+)
+parser.add_argument("--timings", action="store_true", help="Print requests timings")
+parser.add_argument(
+    "--low-memory", action="store_true",
+    help="Keep only status, some headers and body excerpt of failed responses after checking"
+)
+parser.add_argument(
+    "--report", dest="report_file", default=None,
+    help="Write results with timings as json to this file"
+)
 
+parser.add_argument(
+    "--cache-dir", default=None,
+    help="Cache parsed test files in this dir, reparsing only changed ones"
+)
 
-def main(args=sys.argv[1:]):
-    arguments = parser.parse_args(args)
+parser.add_argument(
+    "--watch", action="store_true",
+    help="Keep running, rerun sessions when their files or var files change"
+)
+parser.add_argument(
+    "--watch-interval", type=float, default=0.5,
+    help="Seconds between checks for changes, if inotify is not available"
+)
 
-    sessions = load(arguments.path)
-    if not sessions:
-        print("No test sessions found, exiting")
-        sys.exit(1)
+parser.add_argument(
+    "--shard", type=shard, default=None, metavar="i/N",
+    help="Run i-th of N parts of sessions, split the same way by every worker"
+)
+parser.add_argument(
+    "--durations", metavar="FILE", default=None,
+    help="Sessions durations to balance shards by, see 'restretto merge --durations'"
+)
 
-    passed = failed = errors = 0
-    for test_session in sessions:
-        hdr = "Test session: {}".format(test_session.title)
-        print(hdr)
-        print('-' * len(hdr))
+parser.add_argument(
+    "--metrics", metavar="FILE", default=None,
+    help="Write latencies, status codes and outcomes to OpenMetrics textfile after run"
+)
+parser.add_argument(
+    "--metrics-port", type=positive, default=None,
+    help="Serve OpenMetrics at http://127.0.0.1:PORT/metrics in watch mode"
+)
+
+parser.add_argument(
+    "--profile", metavar="DIR", default=None,
+    help="Profile run, write pstats and collapsed stacks to this dir, print time per phase"
+)
+
+cassettes = parser.add_mutually_exclusive_group()
+cassettes.add_argument(
+    "--record", metavar="FILE", default=None,
+    help="Record responses to cassette file"
+)
+cassettes.add_argument(
+    "--replay", metavar="FILE", default=None,
+    help="Replay responses recorded to cassette file instead of sending requests"
+)
+
+parser.add_argument(
+    "--pool-size", type=positive, default=10,
+    help="Number of hosts to keep connection pools for"
+)
+parser.add_argument(
+    "--pool-connections", type=positive, default=None,
+    help="Max number of connections kept per host (enough for all jobs by default)"
+)
+parser.add_argument(
+    "--no-keep-alive", action="store_true",
+    help="Close connections after each request"
+)
+parser.add_argument(
+    "--prewarm", type=positive, default=None,
+    help="Open this number of connections to each session base uri before run"
+)
+
+
+
+def print_header(test_session, out):
+    hdr = "Test session: {}".format(test_session.title)
+    print(hdr, file=out)
+    print('-' * len(hdr), file=out)
+
+
+def response_text(resource):
+    """Get response body text, if it's available"""
+    if resource.response is None:
+        return ''
+    if resource.stream and resource.downloaded:
+        return '<response body downloaded to {}>'.format(resource.downloaded['path'])
+    return resource.response.text
+
+
+def format_timings(timings):
+    phases = ('wall', 'ttfb', 'transfer', 'templating', 'assertions', 'polling')
+    return ", ".join(
+        "{} {:.1f}ms".format(phase, timings[phase] * 1000) for phase in phases if phase in timings
+    )
+
+
+def print_result(resource, error, arguments, out):
+    """Print resource test result, returns its index in OUTCOMES"""
+    if arguments.timings:
+        print("{} {}: {}".format(paint("blue", "[TIME]"), resource.title, format_timings(resource.timings)), file=out)
+    if error is None:
+        if arguments.print_passed:
+            # TODO: print response status instead
+            print("{} {}: Ok".format(paint("green", "[PASS]"), resource.title), file=out)
+        if arguments.print_response:
+            print(response_text(resource), file=out)
+        return 0
+    if isinstance(error, ExpectError):
+        print("{} {}: {}".format(paint("red", "[FAIL]"), resource.title, error), file=out)
+        if arguments.print_response:
+            print(response_text(resource), file=out)
+        return 1
+    print("{} {}: {}".format(paint("yellow", "[ERROR]"), resource.title, error), file=out)
+    # TODO: remove it
+    if arguments.debug_errors:
+        import ipdb
+        ipdb.set_trace()
+    return 2
+
+
+def resource_record(resource, outcome, error):
+    """Get resource test result as json compatible dict"""
+    response = resource.response
+    return {
+        'title': resource.title,
+        'outcome': OUTCOMES[outcome],
+        'error': None if error is None else str(error),
+        'status': response.status_code if response is not None else None,
+        'timings': resource.timings,
+    }
+
+
+def session_record(test_session):
+    """Get empty session results record"""
+    record = {
+        'title': test_session.title,
+        'filename': test_session.filename,
+        'resources': [],
+        # seconds session run took, used to balance shards
+        'duration': 0.0,
+    }
+    record.update((outcome, 0) for outcome in OUTCOMES)
+    return record
+
+
+def add_result(record, resource, error, arguments, out):
+    outcome = print_result(resource, error, arguments, out)
+    record[OUTCOMES[outcome]] += 1
+    if arguments.metrics or arguments.metrics_port:
+        from .metrics import registry
+        registry().record(record['title'], resource, outcome)
+    if arguments.report_file:
+        record['resources'].append(resource_record(resource, outcome, error))
+
+
+def run_session(test_session, arguments, out=None):
+    """Run session resources in order, returns session results record"""
+    out = out or sys.stdout
+    start = time.perf_counter()
+    record = session_record(test_session)
+    # copy cli vars, session updates given context with its own vars
+    context = dict(arguments.vars or {})
+    print_header(test_session, out)
+    if arguments.parallel_resources > 1:
+        for (resource, error) in test_session.test_all(context, arguments.parallel_resources):
+            add_result(record, resource, error, arguments, out)
+    else:
+        for resource in test_session.resources:
+            try:
+                test_session.test(resource, context=context)
+                error = None
+            except Exception as exc:
+                error = exc
+            add_result(record, resource, error, arguments, out)
+    print("", file=out)
+    record['duration'] = time.perf_counter() - start
+    return record
+
+
+def run_buffered(test_session, arguments):
+    """Run session collecting its output, returns (output, record)"""
+    out = io.StringIO()
+    record = run_session(test_session, arguments, out)
+    return out.getvalue(), record
+
+
+async def run_session_async(test_session, arguments, client):
+    """Run session with async engine, returns (output, record)"""
+    out = io.StringIO()
+    start = time.perf_counter()
+    record = session_record(test_session)
+    context = dict(arguments.vars or {})
+    http = client.session(test_session.headers, test_session.http.verify)
+    print_header(test_session, out)
+    try:
         for resource in test_session.resources:
             try:
-                test_session.test(resource, context=arguments.vars)
-                if arguments.print_passed:
-                    # TODO: print response status instead
-                    print("{} {}: Ok".format(colored.green("[PASS]"), resource.title))
-                if arguments.print_response:
-                    print(resource.response.text)
-                passed += 1
-            except ExpectError as failure:
-                print("{} {}: {}".format(colored.red("[FAIL]"), resource.title, failure))
-                if arguments.print_response:
-                    print(resource.response.text)
-                failed += 1
-            except Exception as error:
-                print("{} {}: {}".format(colored.yellow("[ERROR]"), resource.title, error))
-                # TODO: remove it
-                if arguments.debug_errors:
-                    import ipdb
-                    ipdb.set_trace()
-                errors += 1
-        print("")
+                await test_session.atest(resource, context=context, http=http)
+                error = None
+            except Exception as exc:
+                error = exc
+            add_result(record, resource, error, arguments, out)
+    finally:
+        await http.close()
+    print("", file=out)
+    record['duration'] = time.perf_counter() - start
+    return out.getvalue(), record
+
+
+async def run_async(sessions, arguments):
+    """Run sessions on event loop, at most `jobs` at a time, returns records"""
+    import asyncio
+    from .aio import Client
+    client = Client(
+        limit_per_host=max_connections(arguments), keep_alive=not arguments.no_keep_alive
+    )
+    semaphore = asyncio.Semaphore(arguments.jobs)
+
+    async def run(test_session):
+        async with semaphore:
+            return await run_session_async(test_session, arguments, client)
+
+    results = []
+    try:
+        tasks = [asyncio.ensure_future(run(s)) for s in sessions]
+        # print output in load order, as soon as it's available
+        for task in tasks:
+            (output, record) = await task
+            sys.stdout.write(output)
+            results.append(record)
+    finally:
+        await client.close()
+    return results
+
+
+def max_connections(arguments):
+    """Get max number of connections per host for concurrent jobs"""
+    return arguments.pool_connections or max(10, arguments.jobs * arguments.parallel_resources)
+
+
+def prewarm(sessions, arguments):
+    """Open connections to session base uris ahead of time"""
+    registry = pools.registry()
+    warmed = set()
+    for test_session in sessions:
+        uri = test_session.baseUri
+        if not uri or uri in warmed:
+            continue
+        warmed.add(uri)
+        try:
+            registry.prewarm(uri, test_session.http, arguments.prewarm)
+        except Exception as error:
+            print("{} Can't open connection to {}: {}".format(paint("yellow", "[WARN]"), uri, error))
+
+
+def run_sessions(sessions, arguments, profiler=None):
+    """Run sessions with selected engine and jobs, returns their records
+
+    With profiler sync engine profiles each session, async one is profiled
+    as a whole by profiler of main thread.
+    """
+    results = []
+    if arguments.engine == "async":
+        import asyncio
+        results = asyncio.run(run_async(sessions, arguments))
+    elif arguments.jobs > 1:
+        # sessions are independent, run them in pool and print output grouped
+        # by session in the same order as sequential run does
+        from concurrent.futures import ThreadPoolExecutor
+        run = profiler.wrap(run_buffered, threaded=True) if profiler else run_buffered
+        with ThreadPoolExecutor(max_workers=arguments.jobs) as pool:
+            for (output, record) in pool.map(lambda s: run(s, arguments), sessions):
+                sys.stdout.write(output)
+                results.append(record)
+    else:
+        run = profiler.wrap(run_session) if profiler else run_session
+        for test_session in sessions:
+            results.append(run(test_session, arguments))
+    return results
+
+
+def report(results, arguments):
+    """Print totals, write report file if required, returns (passed, failed, errors)"""
+    passed, failed, errors = (sum(r[outcome] for r in results) for outcome in OUTCOMES)
+    if arguments.report_file:
+        import json
+        with open(arguments.report_file, 'w') as report:
+            json.dump({
+                'shard': '{}/{}'.format(*arguments.shard) if arguments.shard else None,
+                'sessions': results,
+                'passed': passed,
+                'failed': failed,
+                'errors': errors,
+            }, report, indent=2)
+    if arguments.metrics:
+        from .metrics import registry
+        registry().write(arguments.metrics)
     totals = "Total: {} / Passed: {} / Errors: {} / Failed: {}".format(
-        str(passed+failed+errors), colored.green(str(passed)), colored.yellow(str(errors)), colored.red(str(failed))
+        str(passed+failed+errors), paint("green", str(passed)), paint("yellow", str(errors)), paint("red", str(failed))
     )
     print("-" * len(totals))
     print(totals)
     print("")
-    return 1 if (failed or errors) else 0
+    return passed, failed, errors
+
+
+def main(args=sys.argv[1:]):
+    if args and args[0] == "bench":
+        from .bench import main as bench
+        return bench(args[1:])
+    if args and args[0] == "merge":
+        from .shard import main as merge
+        return merge(args[1:])
+    arguments = parser.parse_args(args)
+    if arguments.engine == "async":
+        try:
+            import aiohttp  # noqa
+        except ImportError:
+            parser.error("async engine requires aiohttp to be installed")
+    if arguments.json_decoder:
+        try:
+            set_json_decoder(arguments.json_decoder)
+        except ImportError:
+            parser.error("json decoder {} is not installed".format(arguments.json_decoder))
+
+    if arguments.low_memory:
+        from .rest import set_low_memory
+        set_low_memory(True)
+    if arguments.print_response:
+        # printed responses are read even if nothing checks them
+        from .rest import set_keep_bodies
+        set_keep_bodies(True)
+    cassette = None
+    if arguments.record or arguments.replay:
+        if arguments.engine != "sync":
+            parser.error("--record and --replay are supported by sync engine only")
+        from .cassette import Cassette
+        cassette = Cassette(arguments.record or arguments.replay, "record" if arguments.record else "replay")
+    # sessions created by loader use configured pools
+    pools.configure(
+        pool_size=arguments.pool_size, max_connections=max_connections(arguments),
+        keep_alive=not arguments.no_keep_alive, cassette=cassette
+    )
+    if arguments.metrics_port:
+        if not arguments.watch:
+            parser.error("--metrics-port is supported in watch mode only, use --metrics otherwise")
+        from .metrics import registry
+        registry().serve(arguments.metrics_port)
+    profiler = None
+    if arguments.profile:
+        if arguments.watch:
+            parser.error("--profile is not supported in watch mode")
+        from .profile import Profiler
+        profiler = Profiler(arguments.profile)
+        profiler.start()
+    try:
+        if arguments.watch:
+            # watcher loads sessions itself, tracking files they are loaded from
+            from .watch import watch
+            return watch(arguments)
+        if profiler:
+            with profiler.span("load"):
+                sessions = load(arguments.path, arguments.cache_dir)
+        else:
+            sessions = load(arguments.path, arguments.cache_dir)
+        if not sessions:
+            print("No test sessions found, exiting")
+            sys.exit(1)
+        if arguments.shard:
+            from .shard import load_durations, select
+            sessions = select(sessions, *arguments.shard, load_durations(arguments.durations))
+        if arguments.prewarm and arguments.engine == "sync" and not arguments.replay:
+            prewarm(sessions, arguments)
+        results = run_sessions(sessions, arguments, profiler)
+        if profiler:
+            profiler.stop()
+            profiler.add_timings(sessions)
+            profiler.report()
+        (passed, failed, errors) = report(results, arguments)
+        return 1 if (failed or errors) else 0
+    finally:
+        if profiler and profiler.elapsed is None:
+            profiler.stop()
+        if cassette:
+            cassette.close()
@@ -5,51 +5,78 @@
     ~~~~~~~~~~~~~~~~~~~~
 """
 
-import yaml
 import os
 from .rest import Session
+from .cache import SpecCache, read_stamped
 
 
 SUPPORTED_EXTENSIONS = (".yml", ".yaml")
 
 
-def load_var_files(src, files):
+def parse_yaml(content):
+    """Parse yaml with libyaml based loader, which is much faster, if available"""
+    import yaml
+    return yaml.load(content, Loader=getattr(yaml, 'CFullLoader', yaml.FullLoader))
+
+
+def load_var_files(src, files, stamps=None):
+    """Load vars from files relative to src, stamps of read files are added to stamps"""
     all_vars = {}
     base = os.path.dirname(src)
     for f in files:
         src = os.path.join(base, f)
-        with open(src) as var_file:
-            all_vars.update(yaml.full_load(var_file))
+        (content, stamp) = read_stamped(src)
+        if stamps is not None:
+            stamps[src] = stamp
+        all_vars.update(parse_yaml(content))
     return all_vars
 
 
-def load(path):
-    data = []
+def parse(path):
+    """Parse spec file with its var files, returns (spec, stamps of read files)"""
+    (content, stamp) = read_stamped(path)
+    stamps = {path: stamp}
+    parsed = parse_yaml(content)
+    # silently skip empty files
+    if not parsed:
+        return None, stamps
+    # add filename to spec
+    parsed['filename'] = path
+    # parse vars files, if any
+    var_data = parsed.get('vars', None)
+    if  type(var_data) is str:
+        parsed["vars"] = load_var_files(path, [var_data], stamps)
+    elif type(var_data) is list:
+        # parse set of file
+        parsed["vars"] = load_var_files(path, var_data, stamps)
+    return parsed, stamps
+
+
+def find_files(path):
+    """Get spec files to load from file or directory"""
+    if not os.path.isdir(path):
+        return [path]
     files = []
-    if os.path.isdir(path):
-        # load only files with supported extension skipping hiddens like '.yml'
-        for (curdir, subdirs, entries) in os.walk(path, followlinks=True):
-            for entry in entries:
-                (name, ext) = os.path.splitext(entry)
-                if name and ext in SUPPORTED_EXTENSIONS:
-                    files.append(os.path.join(curdir, entry))
-    else:
-        files.append(path)
-    for entry in files:
-        with open(entry) as source:
-            parsed = yaml.full_load(source)
-        # silently skip empty files
-        if not parsed:
-            continue
-        # add filename to spec
-        parsed['filename'] = entry
-        # parse vars files, if any
-        var_data = parsed.get('vars', None)
-        if  type(var_data) is str:
-            parsed["vars"] = load_var_files(entry, [var_data])
-        elif type(var_data) is list:
-            # parse set of file
-            parsed["vars"] = load_var_files(entry, var_data)
-        data.append(Session(parsed))
+    # load only files with supported extension skipping hiddens like '.yml'
+    for (curdir, subdirs, entries) in os.walk(path, followlinks=True):
+        for entry in entries:
+            (name, ext) = os.path.splitext(entry)
+            if name and ext in SUPPORTED_EXTENSIONS:
+                files.append(os.path.join(curdir, entry))
+    return files
+
+
+def load(path, cache_dir=None):
+    """Load sessions from file or directory, parsed specs are cached in cache_dir"""
+    data = []
+    cache = SpecCache(cache_dir) if cache_dir else None
+    for entry in find_files(path):
+        (found, parsed) = cache.get(entry) if cache else (False, None)
+        if not found:
+            (parsed, stamps) = parse(entry)
+            if cache:
+                cache.put(entry, parsed, stamps)
+        if parsed:
+            data.append(Session(parsed))
     # filter out empty elements (loaded from empty files)
     return [item for item in data if item]
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    OpenMetrics exporter for restretto
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Collects latencies, response status codes and outcomes of resources,
+    labelled by session and resource titles. Metrics are written to a
+    textfile (e.g. for node_exporter textfile collector) after each run or
+    served on local HTTP endpoint in watch mode.
+"""
+
+import os
+import threading
+from .rest import Wait
+from .stats import OUTCOMES, Histogram
+
+
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+# upper bounds of exported latency buckets, seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def escape(value):
+    """Escape label value"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def labels(pairs):
+    """Format [(name, value), ...] as labels set"""
+    return '{' + ','.join('{}="{}"'.format(name, escape(value)) for (name, value) in pairs) + '}'
+
+
+class ResourceMetrics(object):
+    """Latencies, status codes and outcomes of one resource"""
+
+    def __init__(self):
+        self.latency = Histogram()
+        # {status code: count}
+        self.codes = {}
+        self.outcomes = [0] * len(OUTCOMES)
+
+
+class Metrics(object):
+    """Metrics of resources by (session title, resource title)"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.resources = {}
+        self.lock = threading.Lock()
+
+    def record(self, session_title, resource, outcome):
+        """Record resource last result, outcome is index in OUTCOMES
+
+        Resources are labelled by titles given in spec or made of request
+        before templating, so rendered urls with ids or tokens never get
+        into labels. Waits are not recorded.
+        """
+        if isinstance(resource, Wait):
+            return
+        response = resource.response
+        elapsed = resource.timings.get('wall')
+        with self.lock:
+            key = (session_title, resource.describe())
+            metrics = self.resources.get(key)
+            if metrics is None:
+                metrics = self.resources[key] = ResourceMetrics()
+            metrics.outcomes[outcome] += 1
+            if elapsed is not None:
+                metrics.latency.record(elapsed)
+            if response is not None:
+                metrics.codes[response.status_code] = metrics.codes.get(response.status_code, 0) + 1
+
+    def exposition(self):
+        """Get metrics in OpenMetrics text format"""
+        lines = []
+        with self.lock:
+            items = sorted(self.resources.items())
+            name = 'restretto_request_duration_seconds'
+            lines.append('# TYPE {} histogram'.format(name))
+            lines.append('# UNIT {} seconds'.format(name))
+            lines.append('# HELP {} Time resource request took, including assertions.'.format(name))
+            for ((session_title, title), metrics) in items:
+                pairs = [('session', session_title), ('resource', title)]
+                latency = metrics.latency
+                counts = latency.cumulative(self.buckets)
+                for (bound, count) in zip(self.buckets, counts):
+                    lines.append('{}_bucket{} {}'.format(name, labels(pairs + [('le', repr(bound))]), count))
+                lines.append('{}_bucket{} {}'.format(name, labels(pairs + [('le', '+Inf')]), latency.count))
+                lines.append('{}_count{} {}'.format(name, labels(pairs), latency.count))
+                lines.append('{}_sum{} {}'.format(name, labels(pairs), repr(latency.total)))
+            name = 'restretto_responses'
+            lines.append('# TYPE {} counter'.format(name))
+            lines.append('# HELP {} Responses received, by status code.'.format(name))
+            for ((session_title, title), metrics) in items:
+                for (code, count) in sorted(metrics.codes.items()):
+                    pairs = [('session', session_title), ('resource', title), ('code', code)]
+                    lines.append('{}_total{} {}'.format(name, labels(pairs), count))
+            name = 'restretto_results'
+            lines.append('# TYPE {} counter'.format(name))
+            lines.append('# HELP {} Resource tests by outcome, failed ones did not pass assertions.'.format(name))
+            for ((session_title, title), metrics) in items:
+                for (outcome, count) in zip(OUTCOMES, metrics.outcomes):
+                    pairs = [('session', session_title), ('resource', title), ('outcome', outcome)]
+                    lines.append('{}_total{} {}'.format(name, labels(pairs), count))
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """Write metrics to file, replacing it at once so readers never see it partially written"""
+        temporary = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temporary, 'w') as target:
+            target.write(self.exposition())
+        os.replace(temporary, path)
+
+    def serve(self, port, host='127.0.0.1'):
+        """Serve metrics at /metrics in background thread, returns server"""
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.exposition().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        thread = threading.Thread(target=server.serve_forever, name='restretto-metrics', daemon=True)
+        thread.start()
+        return server
+
+
+# metrics recorded by cli, created on first use
+_registry = None
+
+
+def registry():
+    """Get metrics recorded by cli"""
+    global _registry
+    if _registry is None:
+        _registry = Metrics()
+    return _registry
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Shared HTTP connection pools for restretto
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+
+
+
+class PoolRegistry(object):
+    """Connection pools shared by HTTP sessions
+
+    Sessions get the same adapter, which keeps a pool per scheme, host and
+    port, so connections are reused across sessions while cookies and
+    headers stay in each session.
+    """
+
+    def __init__(self, pool_size=10, max_connections=10, keep_alive=True, block=False, cassette=None):
+        # number of hosts to keep pools for
+        self.pool_size = pool_size
+        # max number of connections kept per host
+        self.max_connections = max_connections
+        self.keep_alive = keep_alive
+        from requests.adapters import HTTPAdapter
+        self.adapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=max_connections, pool_block=block
+        )
+        # adapter sessions send requests with, records or replays them if cassette is given
+        self.cassette = cassette
+        self.transport = cassette.adapter(self.adapter) if cassette else self.adapter
+
+    def mount(self, http):
+        """Make requests.Session use shared pools"""
+        http.mount('http://', self.transport)
+        http.mount('https://', self.transport)
+        if not self.keep_alive:
+            http.headers['Connection'] = 'close'
+        return http
+
+    def session(self):
+        """Get new requests.Session using shared pools"""
+        import requests
+        return self.mount(requests.Session())
+
+    def pool(self, url, http=None):
+        """Get connection pool used for url by requests.Session"""
+        import requests
+        http = http or requests.Session()
+        # tls settings are part of pool key, get them the same way requests does
+        settings = http.merge_environment_settings(url, {}, None, None, None)
+        request = requests.Request('GET', url).prepare()
+        if hasattr(self.adapter, 'get_connection_with_tls_context'):
+            return self.adapter.get_connection_with_tls_context(
+                request, settings['verify'], settings['proxies'] or None, settings['cert']
+            )
+        return self.adapter.get_connection(url, settings['proxies'] or None)
+
+    def prewarm(self, url, http=None, connections=1):
+        """Open connections to url host, to be used by next requests of http session"""
+        pool = self.pool(url, http)
+        opened = [pool._get_conn() for i in range(min(connections, self.max_connections))]
+        try:
+            for conn in opened:
+                conn.connect()
+        finally:
+            for conn in opened:
+                pool._put_conn(conn)
+        return len(opened)
+
+
+# registry used by sessions, created on first use
+_registry = None
+
+
+def registry():
+    """Get pools registry used by sessions"""
+    global _registry
+    if _registry is None:
+        _registry = PoolRegistry()
+    return _registry
+
+
+def configure(**options):
+    """Replace pools registry used by sessions created after this call"""
+    global _registry
+    _registry = PoolRegistry(**options)
+    return _registry
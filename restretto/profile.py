@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Profiling support for restretto
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Profiles run with cProfile, by session in threads running them, and
+    samples stacks of all threads for flamegraphs. Writes to directory:
+
+        run.pstats           whole run, all profiles merged
+        sessions/*.pstats    each session, if run by sync engine, sequentially
+                             on python 3.12+
+        run.collapsed        sampled stacks, for flamegraph.pl or speedscope
+
+    Nothing is imported or measured unless --profile is given.
+"""
+
+import os
+import re
+import sys
+import time
+import pstats
+import cProfile
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+
+# seconds between stack samples
+SAMPLE_INTERVAL = 0.001
+
+# from python 3.12 cProfile uses sys.monitoring: only one profiler can be
+# active at a time and it profiles all threads
+SHARED_PROFILER = sys.version_info >= (3, 12)
+
+# phases spans recorded by resources results
+SPAN_PHASES = ('templating', 'ttfb', 'transfer', 'assertions', 'polling')
+
+
+def phase_functions():
+    """Get (phase, functions) for phases measured by cumulative time of functions"""
+    import requests
+    from .assertions import Assert
+    from .loader import parse_yaml
+    from .utils import ContextTemplate, DecodedResponse, apply_context
+    http = [requests.Session.send]
+    try:
+        from .aio import HttpSession
+        http.append(HttpSession.request)
+    except ImportError:
+        pass
+    return (
+        ('yaml parsing', [parse_yaml]),
+        ('templating', [ContextTemplate.render, apply_context]),
+        ('http', http),
+        ('json decoding', [DecodedResponse.json]),
+        ('assertions', [Assert.test]),
+    )
+
+
+def function_key(function):
+    """Get key of function in pstats"""
+    code = function.__code__
+    return (code.co_filename, code.co_firstlineno, code.co_name)
+
+
+class StackSampler(threading.Thread):
+    """Samples stacks of other threads, counting same ones"""
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        super(StackSampler, self).__init__(name='restretto-sampler', daemon=True)
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        own = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            for (ident, frame) in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append('{}:{}'.format(
+                        frame.f_globals.get('__name__', '?'), getattr(code, 'co_qualname', code.co_name)
+                    ))
+                    frame = frame.f_back
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def write(self, path):
+        """Write stacks in collapsed format: frames separated by ; and count"""
+        with open(path, 'w') as target:
+            for (stack, count) in sorted(self.stacks.items()):
+                target.write('{} {}\n'.format(stack, count))
+
+
+class Profiler(object):
+    """Profiles run as a whole and by sessions"""
+
+    def __init__(self, directory, interval=SAMPLE_INTERVAL):
+        self.directory = directory
+        # profile of main thread: loading, async engine
+        self.main = cProfile.Profile()
+        # [(name, profile)] of sessions
+        self.profiles = []
+        self.lock = threading.Lock()
+        self.sampler = StackSampler(interval)
+        # seconds by phase, measured by spans
+        self.spans = {}
+        self.started = self.elapsed = None
+
+    def start(self):
+        self.started = time.perf_counter()
+        self.sampler.start()
+        self.main.enable()
+
+    def stop(self):
+        self.main.disable()
+        self.sampler.stop()
+        self.elapsed = time.perf_counter() - self.started
+
+    @contextmanager
+    def span(self, phase):
+        """Add time spent in block to phase"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_span(phase, time.perf_counter() - start)
+
+    def add_span(self, phase, seconds):
+        with self.lock:
+            self.spans[phase] = self.spans.get(phase, 0.0) + seconds
+
+    def add_timings(self, sessions):
+        """Add phases timings of sessions resources last results"""
+        for test_session in sessions:
+            for resource in test_session.resources:
+                for (phase, seconds) in resource.timings.items():
+                    if phase in SPAN_PHASES:
+                        self.add_span(phase, seconds)
+
+    def wrap(self, run, threaded=False):
+        """Get run(test_session, *args) function, profiling session in thread running it
+
+        Sessions run by threads concurrently are profiled by main profiler
+        only, if it profiles all threads.
+        """
+        if threaded and SHARED_PROFILER:
+            return run
+
+        def profiled(test_session, *args):
+            profile = cProfile.Profile()
+            # thread has only one active profiler
+            main = threading.current_thread() is threading.main_thread()
+            if main:
+                self.main.disable()
+            profile.enable()
+            try:
+                return run(test_session, *args)
+            finally:
+                profile.disable()
+                if main:
+                    self.main.enable()
+                with self.lock:
+                    self.profiles.append((test_session.title or 'session', profile))
+        return profiled
+
+    def stats(self):
+        """Get merged stats of all profiles"""
+        stats = pstats.Stats(self.main)
+        for (name, profile) in self.profiles:
+            stats.add(profile)
+        return stats
+
+    def write(self):
+        """Write profiles and stacks, returns merged stats"""
+        os.makedirs(self.directory, exist_ok=True)
+        if self.profiles:
+            sessions_dir = os.path.join(self.directory, 'sessions')
+            os.makedirs(sessions_dir, exist_ok=True)
+            for (index, (name, profile)) in enumerate(self.profiles):
+                slug = re.sub(r'[^\w.-]+', '-', name).strip('-')[:60]
+                profile.dump_stats(os.path.join(sessions_dir, '{:03d}-{}.pstats'.format(index + 1, slug)))
+        stats = self.stats()
+        stats.dump_stats(os.path.join(self.directory, 'run.pstats'))
+        self.sampler.write(os.path.join(self.directory, 'run.collapsed'))
+        return stats
+
+    def summary(self, stats):
+        """Get rows of (phase, seconds) measured by spans and by functions"""
+        spans = [(phase, self.spans[phase]) for phase in ('load', ) + SPAN_PHASES if phase in self.spans]
+        functions = []
+        for (phase, phase_funcs) in phase_functions():
+            seconds = sum(stats.stats[key][3] for key in map(function_key, phase_funcs) if key in stats.stats)
+            functions.append((phase, seconds))
+        return spans, functions
+
+    def report(self, out=None):
+        """Write profiles, print time per phase"""
+        out = out or sys.stdout
+        (spans, functions) = self.summary(self.write())
+        row = "{:<30} {:>10} {:>8}"
+        print(row.format("Phase", "Seconds", "Share"), file=out)
+        for (title, rows) in (("spans", spans), ("functions, cumulative", functions)):
+            print("-- {}".format(title), file=out)
+            for (phase, seconds) in rows:
+                share = seconds / self.elapsed * 100 if self.elapsed else 0.0
+                print(row.format(phase, '{:.3f}'.format(seconds), '{:.1f}%'.format(share)), file=out)
+        print(row.format("run", '{:.3f}'.format(self.elapsed), '100.0%'), file=out)
+        print("Profiles written to {}".format(self.directory), file=out)
+        print("", file=out)
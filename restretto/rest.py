@@ -4,21 +4,268 @@
     ~~~~~~~~~~~~~~~~~~~~~~~~~~
 """
 
+import copy
 import time
-import requests
-from urllib.request import urljoin
+from collections import ChainMap
+import random
+import hashlib
+from contextlib import contextmanager
+from urllib.parse import urljoin
 
-from .utils import json_path
+from .utils import compile_path, JsonPath
 from . import assertions
-from .errors import ParseError
-from .utils import apply_context
+from . import pools
+from .errors import ParseError, ExpectError
+from .utils import apply_context, json_decoder, ContextTemplate, DecodedResponse
+from .utils import referenced_variables
 
 
 HTTP_METHODS = frozenset(('get', 'options', 'head', 'post', 'put', 'patch', 'delete'))
 
+# default size of chunks response body downloaded by
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# response headers kept in summary, when response body is released
+SUMMARY_HEADERS = ('Content-Type', 'Content-Length', 'Content-Encoding', 'Location', 'ETag', 'Date')
+# size of response body excerpt kept for failed resources, bytes
+EXCERPT_SIZE = 2048
+
+# errors of checking response not ready yet: failed assertion, missing
+# property or body which is not json
+CHECK_ERRORS = (ExpectError, LookupError, TypeError, ValueError)
+
+# bodies up to this size are read to reuse connection, when nothing checks them
+DRAIN_LIMIT = 64 * 1024
+
+# keep response summaries instead of responses, unless session says otherwise
+default_low_memory = False
+# read response bodies even if nothing checks them, e.g. to print them
+default_keep_bodies = False
+
+
+def set_low_memory(enabled=True):
+    """Set if sessions keep response summaries by default"""
+    global default_low_memory
+    default_low_memory = enabled
+
+
+def set_keep_bodies(enabled=True):
+    """Set if sessions read response bodies assertions and vars don't use"""
+    global default_keep_bodies
+    default_keep_bodies = enabled
+
+
+def skip_body(response, limit=DRAIN_LIMIT):
+    """Release connection of streamed response without keeping its body
+
+    Body of unknown length (chunked) or known to be short is read up to
+    limit and discarded, so connection goes back to pool if body ends
+    within limit, connection is closed otherwise. Response content is
+    empty then.
+    """
+    if getattr(response, '_content', None) is not False:
+        # body is read already, e.g. replayed from cassette or by async engine
+        return
+    raw = response.raw
+    # urllib3 knows there is no body for HEAD, 204 and 304
+    remaining = getattr(raw, 'length_remaining', None)
+    if remaining is not None and remaining > limit:
+        response.close()
+    else:
+        drained = 0
+        while drained <= limit:
+            chunk = raw.read(DOWNLOAD_CHUNK_SIZE, decode_content=False)
+            if not chunk:
+                raw.release_conn()
+                break
+            drained += len(chunk)
+        else:
+            response.close()
+    response._content = b''
+    response._content_consumed = True
+
+
+class Download(object):
+    """Response body download to file"""
+
+    def __init__(self, spec):
+        if isinstance(spec, str):
+            spec = {'path': spec}
+        if not spec.get('path'):
+            raise ParseError('Download path not specified')
+        # path taken relative to cwd, may be should be changed to yml-related path
+        # see https://github.com/wirewit/restretto/issues/16 for details
+        self.path = spec['path']
+        self.chunk_size = int(spec.get('chunk_size', DOWNLOAD_CHUNK_SIZE))
+        # hashlib algorithm name for body checksum, if required
+        self.checksum = spec.get('checksum')
+        if self.checksum and self.checksum not in hashlib.algorithms_available:
+            raise ParseError('Unknown checksum algorithm: {}'.format(self.checksum))
+
+    def save(self, response):
+        """Write response body to file chunk by chunk, returns its size and checksum"""
+        digest = hashlib.new(self.checksum) if self.checksum else None
+        size = 0
+        with open(self.path, "wb") as download:
+            for chunk in response.iter_content(self.chunk_size):
+                download.write(chunk)
+                size += len(chunk)
+                if digest:
+                    digest.update(chunk)
+        return {
+            'path': self.path,
+            'size': size,
+            'checksum': digest.hexdigest() if digest else None
+        }
+
+
+class ResponseSummary(object):
+    """Compact response replacement: status, selected headers and body excerpt"""
+
+    def __init__(self, response, excerpt=False):
+        self.status_code = response.status_code
+        self.reason = response.reason
+        self.url = str(response.url)
+        self.ok = response.ok
+        self.headers = {
+            name: response.headers[name] for name in SUMMARY_HEADERS if name in response.headers
+        }
+        self.excerpt = None
+        # body size, None if body is not read
+        self.size = None
+        if getattr(response, 'downloaded', None) is not None:
+            # streamed body is read by download already
+            return
+        if getattr(response, '_content', None) is False:
+            # streamed body is not read, e.g. download failed before it, only excerpt is read
+            if excerpt:
+                content = next(response.iter_content(EXCERPT_SIZE), b'')
+                self.excerpt = content.decode(response.encoding or 'utf-8', 'replace')
+                if len(content) >= EXCERPT_SIZE:
+                    self.excerpt += '... <rest of body not read>'
+            return
+        content = response.content or b''
+        self.size = len(content)
+        if excerpt:
+            self.excerpt = content[:EXCERPT_SIZE].decode(response.encoding or 'utf-8', 'replace')
+            if self.size > EXCERPT_SIZE:
+                self.excerpt += '... <{} bytes more>'.format(self.size - EXCERPT_SIZE)
+
+    def __bool__(self):
+        return self.ok
+
+    @property
+    def text(self):
+        if self.excerpt is not None:
+            return self.excerpt
+        if self.size is None:
+            return '<response body not read>'
+        return '<response body of {} bytes released>'.format(self.size)
+
+
+class Result(object):
+    """Outcome of single resource execution"""
+
+    def __init__(self, resource):
+        self.resource = resource
+        # request arguments after templating
+        self.prepared = None
+        self.response = None
+        self.downloaded = None
+        self.error = None
+        # context vars bound from response
+        self.vars = {}
+        # time spent in execution phases, seconds
+        self.timings = {}
+        self.attempts = 0
+
+    @property
+    def title(self):
+        return self.resource.describe(self.prepared)
+
+    @property
+    def passed(self):
+        return self.error is None
+
+    @contextmanager
+    def timing(self, phase):
+        """Add time spent in block to phase timing"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[phase] = self.timings.get(phase, 0.0) + time.perf_counter() - start
+
+    def release(self):
+        """Replace response with its summary, so body can be freed"""
+        response = self.response
+        if response is None or isinstance(response, ResponseSummary):
+            return
+        self.response = ResponseSummary(response, excerpt=self.error is not None)
+        close = getattr(response, 'close', None)
+        if close:
+            close()
+
+
+def last_result(name, default=lambda: None):
+    """Property getting attribute of the last result kept by test()"""
+    def get(self):
+        return default() if self.last is None else getattr(self.last, name)
+    return property(get)
+
+
+class Polling(object):
+    """Resource polling until its assertions pass or timeout is hit"""
+
+    def __init__(self, spec):
+        if not isinstance(spec, dict):
+            spec = {'timeout': spec}
+        try:
+            self.timeout = float(spec['timeout'])
+            # delay before second attempt, multiplied by backoff after each next one
+            self.interval = float(spec.get('interval', 0.5))
+            self.backoff = float(spec.get('backoff', 1))
+            self.max_interval = float(spec.get('max_interval', self.timeout))
+            # random part of delay, 0.1 makes it 10% shorter or longer at most
+            self.jitter = float(spec.get('jitter', 0))
+        except (KeyError, TypeError, ValueError):
+            raise ParseError('Invalid wait_until: {}'.format(spec))
+        if self.timeout < 0 or self.interval < 0 or self.backoff < 1 or not 0 <= self.jitter <= 1:
+            raise ParseError('Invalid wait_until: {}'.format(spec))
+
+    def delays(self, rand=random.random):
+        """Yield delays before next attempts, None if no time left for another one"""
+        deadline = time.monotonic() + self.timeout
+        interval = self.interval
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                yield None
+                return
+            delay = min(interval, self.max_interval) * (1 + self.jitter * (2 * rand() - 1))
+            # last attempt is made at deadline
+            yield min(delay, remaining)
+            interval *= self.backoff
+
 
 class Resource(object):
-    """Single HTTP resource"""
+    """Single HTTP resource
+
+    Resource is an execution plan parsed once: normalized request, compiled
+    assertions and var bindings are not changed by executions, so it can be
+    executed many times, concurrently too. Each execution gives new Result,
+    test() keeps the last one, its attributes are available on resource.
+    """
+
+    # attributes of the last result
+    last = None
+    prepared = last_result('prepared')
+    response = last_result('response')
+    downloaded = last_result('downloaded')
+    error = last_result('error')
+    vars = last_result('vars', dict)
+    timings = last_result('timings', dict)
+    attempts = last_result('attempts', int)
 
     @staticmethod
     def parse_from_dict(spec):
@@ -54,46 +301,92 @@ class Resource(object):
         # clean empty fields
         return {k: v for k, v in request.items() if v is not None}
 
-    def __init__(self, spec):
+    def __init__(self, spec, native=True, decoder=None, low_memory=False, keep_body=False):
         """Create resource from specification"""
         if isinstance(spec, str):
             self.spec = {'url': spec}
         else:
             self.spec = spec
 
-        # get context var bindings
-        self.vars = self.spec.get('vars', {})
+        # render templates to native types or parse rendered as yaml
+        self.native = native
+        # json decoder module name, default if not given
+        self.decoder = decoder
+        # response is replaced by its summary after checking
+        self.low_memory = low_memory
+
+        # get context var bindings, paths compiled to accessors
+        self.bindings = {
+            name: compile_path(path) for (name, path) in self.spec.get('vars', {}).items()
+        }
 
         # get asserions
         if 'expect' in spec and 'assert' in spec:
             # only one form of assertions should be used at a time
             raise ParseError("Only expect or assert keyword can be used")
         self.asserts = self.spec.get('assert', self.spec.get('expect'))
+        # compiled once, only templated operands are rendered on each test
+        self.assertion = assertions.Assert(self.asserts, self.native)
 
         # set download path for response, if required
-        self.download = self.spec.get('download', None)
+        download = self.spec.get('download', None)
+        self.download = Download(download) if download else None
+        # body is streamed to file if nothing else reads it
+        self.stream = bool(self.download) and not self.reads_body
+        # body is not read at all if nothing uses it
+        self.skip_body = not (self.download or self.reads_body or keep_body)
+        # request is repeated while assertions fail, if polling is set
+        polling = self.spec.get('wait_until')
+        self.polling = Polling(polling) if polling is not None else None
 
         self.request = self.parse_from_dict(self.spec)
-        # response and errors are not known
-        self.response = None
-        self.error = None
+        # templated fields of request, with variables they use
+        self.template = ContextTemplate(self.request, self.native)
+        # resource should be run after all previous and before all next ones
+        self.barrier = bool(self.spec.get('barrier', False))
+
+    @property
+    def references(self):
+        """Names of context vars used by request and assertions templates"""
+        return self.template.variables | referenced_variables(self.asserts)
+
+    @property
+    def produces(self):
+        """Names of context vars bound from response"""
+        return frozenset(self.bindings)
+
+    @property
+    def reads_body(self):
+        """True if assertions or vars bindings use response body"""
+        if any(JsonPath._split(path.path)[:1] == ['json'] for path in self.bindings.values()):
+            return True
+        return any(isinstance(stmt, assertions.BodyTest) for stmt in self.assertion.statements)
 
     @property
     def title(self):
+        return self.describe(self.prepared)
+
+    def describe(self, prepared=None):
+        """Get title, made of request (prepared one, if given) if it's not set"""
         return self.spec.get('title') or self.spec.get('name') \
-            or '{method} {url}'.format(**self.request)
+            or '{method} {url}'.format(**(prepared or self.request))
 
-    def test(self, baseUri='', context={}, session=None):
-        """Make request, perform assertion testing"""
-        self.request['url'] = urljoin(baseUri, self.request['url'].lstrip('/'))
-        # apply template to request and assertions
-        self.request = apply_context(self.request, context)
-        self.asserts = apply_context(self.asserts, context)
+    def prepare(self, baseUri='', context={}):
+        """Apply context to request, returns request arguments
+
+        Parsed request is kept intact, so resource can be tested again
+        with another context.
+        """
+        # apply template to request
+        # only templated fields are rendered, top level dict is copied
+        request = dict(self.template.render(context))
+        # join url after templating, so precompiled url template is used
+        request['url'] = urljoin(baseUri, str(request['url']).lstrip('/'))
         # load files, if provided
         # TODO: add mimetype detection
         # TODO: files should be searched relative to current yml
         # see https://github.com/wirewit/restretto/issues/16 for details
-        file_data = self.request.pop('files', {})
+        file_data = request.pop('files', {})
         if type(file_data) is list:
             # parsing files: [file1, file2] structure, assuming name as "files"
             file_data = {
@@ -102,92 +395,250 @@ class Resource(object):
         # TODO: raise exception on parsing not-dict structure
         if type(file_data) is dict:
             # parsing name: file or name: [file1, file2] structure
-            self.request['files'] = []
+            request['files'] = []
             for file_name, file_path in file_data.items():
                 if type(file_path) is str:
-                    self.request['files'].append((file_name, open(file_path, 'rb')))
+                    request['files'].append((file_name, open(file_path, 'rb')))
                 elif type(file_path) is list:
                     for f in file_path:
-                        self.request['files'].append((file_name, open(f, 'rb')))
+                        request['files'].append((file_name, open(f, 'rb')))
 
         # make sure all headers are strings
-        if "headers" in self.request:
-            for k, v in self.request["headers"].items():
-                self.request["headers"][k] = str(v)
+        if "headers" in request:
+            request["headers"] = {k: str(v) for (k, v) in request["headers"].items()}
+        return request
 
-        # create assertions
-        assertion = assertions.Assert(self.asserts)
-        # get response
-        http = session or requests.Session()
-        self.response = http.request(**self.request)
+    def check(self, result, response, context={}):
+        """Perform assertion testing on response, bind vars to result"""
+        assertion = self.assertion
+        # share decoded json body between assertions and vars binding
+        result.response = DecodedResponse(response, json_decoder(self.decoder))
         # test assertion, will raise an excep
         try:
-            assertion.test(self.response)
+            with result.timing('assertions'):
+                assertion.test(result.response, context)
+                # save context vars
+                if self.bindings:
+                    result.vars = self.bind(result.response)
+            # save response body as downloaded file
+            if self.download:
+                with result.timing('transfer'):
+                    result.downloaded = self.download.save(result.response)
+                result.response.downloaded = result.downloaded
+                with result.timing('assertions'):
+                    assertion.test(result.response, context, after_download=True)
         except Exception as error:
             # save error
-            self.error = error
+            result.error = error
             # reraise
             raise
-        # save context vars
-        if self.vars:
-            data = {
-                'headers': self.response.headers
-            }
-            try:
-                data['json'] = self.response.json()
-            except ValueError:
-                # no json, it's can be ok
-                data['json'] = None
-                pass
-            for name, path in self.vars.items():
-                self.vars[name] = json_path(path, data)
-
-        # save response body as downloaded file
-        # path taken relative to cwd, may be should be changed to yml-related path
-        # see https://github.com/wirewit/restretto/issues/16 for details
-        if self.download:
-            with open(self.download, "wb") as download:
-                download.write(self.response.content)
+        finally:
+            if self.low_memory:
+                result.release()
+            elif self.stream and result.downloaded is None:
+                # streamed body is not read, e.g. check failed before download,
+                # connection is released now, not when result is freed
+                skip_body(result.response.response)
+        return result
+
+    def bind(self, response):
+        """Extract vars values from response"""
+        data = {
+            'headers': response.headers
+        }
+        try:
+            data['json'] = response.json()
+        except ValueError:
+            # no json, it's can be ok
+            data['json'] = None
+        return {name: path.get(data) for (name, path) in self.bindings.items()}
+
+    @staticmethod
+    def retried(result, error):
+        """True if polling should make another attempt after error"""
+        # response is set before checking it, so errors of transport and
+        # templating are not retried, while missing or not yet json body is
+        return isinstance(error, ExpectError) or result.response is not None
+
+    def attempt(self, result, baseUri='', context={}, session=None):
+        """Make request once, perform assertion testing"""
+        result.attempts += 1
+        result.response = result.downloaded = result.error = None
+        with result.timing('templating'):
+            request = result.prepared = self.prepare(baseUri, context)
+        # get response
+        http = session or pools.registry().session()
+        with result.timing('ttfb'):
+            # body is read separately to measure its transfer time
+            response = http.request(stream=True, **request)
+        if self.skip_body:
+            with result.timing('transfer'):
+                skip_body(response)
+        elif not self.stream:
+            with result.timing('transfer'):
+                response.content
+        return self.check(result, response, context)
+
+    def execute(self, baseUri='', context={}, session=None):
+        """Make request, perform assertion testing, polling if required
+
+        Returns new result, errors are not raised but kept in result.
+        """
+        result = Result(self)
+        try:
+            with result.timing('wall'):
+                if self.polling is None:
+                    return self.attempt(result, baseUri, context, session)
+                for delay in self.polling.delays():
+                    try:
+                        return self.attempt(result, baseUri, context, session)
+                    except CHECK_ERRORS as error:
+                        if delay is None or not self.retried(result, error):
+                            raise
+                    with result.timing('polling'):
+                        time.sleep(delay)
+        except Exception as error:
+            result.error = error
+        return result
+
+    def test(self, baseUri='', context={}, session=None):
+        """Execute resource keeping its result, raises error if it's failed"""
+        self.last = self.execute(baseUri, context, session)
+        if self.last.error is not None:
+            raise self.last.error
+        return self
+
+    async def aattempt(self, result, baseUri='', context={}, session=None):
+        """Make request once with asyncio http session, perform assertion testing"""
+        result.attempts += 1
+        result.response = result.downloaded = result.error = None
+        with result.timing('templating'):
+            request = result.prepared = self.prepare(baseUri, context)
+        response = await session.request(stream=self.stream, skip_body=self.skip_body, **request)
+        for (phase, value) in response.timings.items():
+            result.timings[phase] = result.timings.get(phase, 0.0) + value
+        return self.check(result, response, context)
+
+    async def aexecute(self, baseUri='', context={}, session=None):
+        """Asynchronous version of execute, session is aio.HttpSession
+
+        Polling delays do not block event loop, so other sessions keep running.
+        """
+        result = Result(self)
+        try:
+            with result.timing('wall'):
+                if self.polling is None:
+                    return await self.aattempt(result, baseUri, context, session)
+                import asyncio
+                for delay in self.polling.delays():
+                    try:
+                        return await self.aattempt(result, baseUri, context, session)
+                    except CHECK_ERRORS as error:
+                        if delay is None or not self.retried(result, error):
+                            raise
+                    with result.timing('polling'):
+                        await asyncio.sleep(delay)
+        except Exception as error:
+            result.error = error
+        return result
 
+    async def atest(self, baseUri='', context={}, session=None):
+        """Asynchronous version of test"""
+        self.last = await self.aexecute(baseUri, context, session)
+        if self.last.error is not None:
+            raise self.last.error
         return self
 
 
 class Wait(object):
 
+    # waiting is done after all previous and before all next resources
+    barrier = True
+    references = produces = frozenset()
+    # nothing requested
+    stream = False
+    # attributes of the last result
+    last = None
+    prepared = response = downloaded = error = None
+    vars = last_result('vars', dict)
+    timings = last_result('timings', dict)
+
     def __init__(self, spec):
         self.spec = spec
-        self.vars = {}
         self.delay = int(spec.get("wait", 0))
 
     @property
     def title(self):
+        return self.describe()
+
+    def describe(self, prepared=None):
         return self.spec.get('title') or self.spec.get('name') \
             or 'Waiting for {} second(s)'.format(self.delay)
 
+    def execute(self, *args, **kwargs):
+        result = Result(self)
+        with result.timing('wall'):
+            time.sleep(self.delay)
+        return result
+
     def test(self, *args, **kwargs):
-        time.sleep(self.delay)
+        self.last = self.execute()
+        return self
+
+    async def aexecute(self, *args, **kwargs):
+        import asyncio
+        result = Result(self)
+        with result.timing('wall'):
+            await asyncio.sleep(self.delay)
+        return result
+
+    async def atest(self, *args, **kwargs):
+        self.last = await self.aexecute()
         return self
 
 
 class Session(object):
-    """REST session"""
+    """REST session
+
+    Resources are parsed once, fork() gives session sharing them, but with
+    own context, headers and cookies, like each virtual user needs.
+    """
 
     def __init__(self, spec, context={}):
         self.spec = spec
-        self.context = spec.get('vars', {}).copy()
+        # yaml templating is compatibility mode for pre-native templates
+        self.native = spec.get('templating', 'native') != 'yaml'
+        # json decoder module for responses (json, ujson, orjson)
+        self.decoder = spec.get('json_decoder')
+        # keep only response summaries, for long suites with large bodies
+        self.low_memory = spec.get('low_memory', default_low_memory)
+        # read bodies nothing checks, so they are available after test
+        self.keep_bodies = spec.get('keep_bodies', default_keep_bodies)
+        self._start(context)
+        # create resources
+        self.resources = []
+        self._parse_resources()
+
+    def _start(self, context):
+        """Set up context and http session"""
+        self.context = self.spec.get('vars', {}).copy()
         self.context.update(context)
-        self.baseUri = apply_context(spec.get('baseUri', ''), self.context)
-        self.http = requests.Session()
+        self.baseUri = apply_context(self.spec.get('baseUri', ''), self.context, self.native)
+        # own cookies and headers, but connections are shared with other sessions
+        self.http = pools.registry().session()
         headers = self.spec.get('headers') or {}
-        self.headers = apply_context(headers, self.context)
+        self.headers = apply_context(headers, self.context, self.native)
         # make sure all headers are strings
         for k, v in self.headers.items():
             self.headers[k] = str(v)
         self.http.headers.update(self.headers)
-        self.http.verify = spec.get('verify', False)
-        # create resources
-        self.resources = []
-        self._parse_resources()
+        self.http.verify = self.spec.get('verify', False)
+
+    def fork(self, context={}):
+        """Get session with the same resources, own context and cookies"""
+        forked = copy.copy(self)
+        forked._start(context)
+        return forked
 
     def _parse_resources(self):
         """Get resources from loaded session spec"""
@@ -196,7 +647,7 @@ class Session(object):
             if "wait" in item:
                 self.resources.append(Wait(item))
             else:
-                self.resources.append(Resource(item))
+                self.resources.append(Resource(item, self.native, self.decoder, self.low_memory, self.keep_bodies))
 
     def __bool__(self):
         return bool(self.resources)
@@ -210,8 +661,79 @@ class Session(object):
         return self.spec.get('title', '') or self.spec.get('name', '') or self.spec.get('session', '')
 
     def test(self, resource=None, context=None):
-        context = context or {}
-        context.update(self.context)
+        # session vars take precedence, no context is copied
+        context = ChainMap(self.context, context or {})
         executed = resource.test(self.baseUri, context, self.http)
         self.context.update(executed.vars)
         return executed
+
+    def execute(self, resource, context=None):
+        """Execute resource, returns its result, context is updated if it's passed"""
+        context = ChainMap(self.context, context or {})
+        result = resource.execute(self.baseUri, context, self.http)
+        if result.passed:
+            self.context.update(result.vars)
+        return result
+
+    def dependencies(self):
+        """Get indexes of resources each resource should be run after
+
+        Resource depends on previous resources binding vars it uses, and on
+        previous resources using or binding vars it binds itself. Barriers
+        depend on all previous resources and all next depend on barriers.
+        """
+        result = []
+        barrier = None
+        for (index, resource) in enumerate(self.resources):
+            if resource.barrier:
+                deps = set(range(index))
+                barrier = index
+            else:
+                deps = set() if barrier is None else {barrier}
+                for (prev_index, prev) in enumerate(self.resources[:index]):
+                    if (prev.produces & resource.references) or \
+                            (resource.produces & (prev.produces | prev.references)):
+                        deps.add(prev_index)
+            result.append(deps)
+        return result
+
+    def test_all(self, context=None, workers=1):
+        """Test all resources, independent ones concurrently by workers
+
+        Yields (resource, error) in resources order, error is None if passed.
+        """
+        from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+        context = context or {}
+        dependencies = self.dependencies()
+
+        def run(resource):
+            try:
+                # each resource gets own copy of context
+                self.test(resource, dict(context))
+            except Exception as error:
+                return error
+
+        futures = {}
+        errors = {}
+        next_index = 0
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while next_index < len(self.resources):
+                # start all resources which dependencies are completed
+                for (index, resource) in enumerate(self.resources):
+                    if index not in futures and dependencies[index] <= errors.keys():
+                        futures[index] = pool.submit(run, resource)
+                running = [f for (index, f) in futures.items() if index not in errors]
+                (completed, _) = wait(running, return_when=FIRST_COMPLETED)
+                for (index, future) in futures.items():
+                    if future in completed:
+                        errors[index] = future.result()
+                while next_index in errors:
+                    yield self.resources[next_index], errors[next_index]
+                    next_index += 1
+
+    async def atest(self, resource=None, context=None, http=None):
+        """Asynchronous version of test, http is a session of aio.Client"""
+        context = ChainMap(self.context, context or {})
+        executed = await resource.atest(self.baseUri, context, http)
+        self.context.update(executed.vars)
+        return executed
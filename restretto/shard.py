@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Suite sharding for restretto
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Splits sessions between workers balancing by durations of previous
+    runs, and merges report files written by workers.
+"""
+
+import os
+import sys
+import json
+from argparse import ArgumentParser, ArgumentTypeError
+
+
+def shard(encoded):
+    """Returns (index, total) parsed from string in form i/N, index is 1-based"""
+    try:
+        (index, total) = (int(part) for part in encoded.split('/'))
+        if not 1 <= index <= total:
+            raise ValueError
+    except ValueError:
+        raise ArgumentTypeError("expected shard as i/N with 1 <= i <= N, got {}".format(encoded))
+    return index, total
+
+
+def session_key(test_session):
+    """Get key session durations are stored by"""
+    if test_session.filename:
+        return os.path.normpath(test_session.filename)
+    return test_session.title
+
+
+def load_durations(path):
+    """Get {session key: seconds}, empty if file doesn't exist"""
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path) as source:
+        return json.load(source)
+
+
+def weights(keys, sizes, durations):
+    """Get expected durations, guessed by resources count for unknown sessions"""
+    known = [k for k in keys if k in durations]
+    # seconds per resource of known sessions
+    rate = sum(durations[k] for k in known) / (sum(sizes[k] for k in known) or 1) if known else 1.0
+    return {k: durations[k] if k in durations else sizes[k] * rate for k in keys}
+
+
+def split(sessions, total, durations=None):
+    """Split sessions into total shards of about the same expected duration
+
+    Longest sessions are given to least loaded shards first. Ties are
+    resolved by session key, so split does not depend on loading order
+    and every worker gets the same one. Shards keep loading order.
+    """
+    keys = [session_key(s) for s in sessions]
+    sizes = {k: len(s.resources) for (k, s) in zip(keys, sessions)}
+    expected = weights(keys, sizes, durations or {})
+    loads = [0.0] * total
+    assigned = {}
+    for key in sorted(set(keys), key=lambda k: (-expected[k], k)):
+        target = min(range(total), key=lambda i: (loads[i], i))
+        loads[target] += expected[key]
+        assigned[key] = target
+    shards = [[] for i in range(total)]
+    for (key, test_session) in zip(keys, sessions):
+        shards[assigned[key]].append(test_session)
+    return shards
+
+
+def select(sessions, index, total, durations=None):
+    """Get sessions of shard index (1-based) out of total"""
+    return split(sessions, total, durations)[index - 1]
+
+
+def merge(reports):
+    """Merge reports written by shards into one"""
+    merged = {'sessions': [], 'passed': 0, 'failed': 0, 'errors': 0}
+    for report in reports:
+        merged['sessions'].extend(report['sessions'])
+        for outcome in ('passed', 'failed', 'errors'):
+            merged[outcome] += report[outcome]
+    return merged
+
+
+def report_durations(report, durations=None):
+    """Update durations with ones of report sessions"""
+    durations = dict(durations or {})
+    for record in report['sessions']:
+        key = os.path.normpath(record['filename']) if record.get('filename') else record['title']
+        durations[key] = record.get('duration', 0.0)
+    return durations
+
+
+parser = ArgumentParser(prog="restretto merge", description="Merge report files of shards")
+parser.add_argument("reports", nargs="+", help="report files written with --report")
+parser.add_argument("-o", "--output", default=None, help="Write merged report to this file")
+parser.add_argument(
+    "--durations", default=None,
+    help="Update sessions durations in this file, to balance next --shard runs")
+
+
+def main(args=sys.argv[1:]):
+    arguments = parser.parse_args(args)
+    reports = []
+    for path in arguments.reports:
+        with open(path) as source:
+            reports.append(json.load(source))
+    merged = merge(reports)
+    if arguments.output:
+        with open(arguments.output, 'w') as target:
+            json.dump(merged, target, indent=2)
+    if arguments.durations:
+        durations = report_durations(merged, load_durations(arguments.durations))
+        with open(arguments.durations, 'w') as target:
+            json.dump(durations, target, indent=2, sort_keys=True)
+    print("Total: {} / Passed: {} / Errors: {} / Failed: {}".format(
+        merged['passed'] + merged['failed'] + merged['errors'],
+        merged['passed'], merged['errors'], merged['failed']
+    ))
+    return 1 if (merged['failed'] or merged['errors']) else 0
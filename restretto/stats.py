@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Latency statistics for restretto
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+
+import math
+
+
+class Histogram(object):
+    """Log-bucketed histogram of positive values (seconds)
+
+    Buckets grow by `precision` relative step, so memory stays bounded by
+    values range, not by number of recorded values, while percentiles are
+    accurate within the precision.
+    """
+
+    def __init__(self, precision=0.01, lowest=1e-6):
+        self.precision = precision
+        self.lowest = lowest
+        self._log_base = math.log1p(precision)
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def bucket(self, value):
+        """Get index of bucket for value"""
+        return int(math.log(max(value, self.lowest) / self.lowest) / self._log_base)
+
+    def bound(self, index):
+        """Get upper bound of bucket values"""
+        return self.lowest * math.exp((index + 1) * self._log_base)
+
+    def record(self, value):
+        index = self.bucket(value)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other):
+        """Add values recorded by other histogram with the same precision"""
+        for (index, count) in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+        return self
+
+    def cumulative(self, bounds):
+        """Get numbers of values up to each of sorted bounds, within precision"""
+        counts = []
+        indexes = sorted(self.buckets)
+        (position, seen) = (0, 0)
+        for bound in bounds:
+            if self.max is not None and self.max <= bound:
+                counts.append(self.count)
+                continue
+            while position < len(indexes) and self.bound(indexes[position]) <= bound:
+                seen += self.buckets[indexes[position]]
+                position += 1
+            counts.append(seen)
+        return counts
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def percentile(self, percent):
+        """Get value below which given percent of recorded values are"""
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(self.count * percent / 100.0))
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(max(self.bound(index), self.min), self.max)
+        return self.max
+
+
+# resource test outcomes, recorded by index
+OUTCOMES = ('passed', 'failed', 'errors')
+
+
+class ResourceStats(object):
+    """Outcomes and latencies of resource executions"""
+
+    def __init__(self, title):
+        self.title = title
+        self.latency = Histogram()
+        self.passed = 0
+        self.failed = 0
+        self.errors = 0
+
+    @property
+    def count(self):
+        return self.passed + self.failed + self.errors
+
+    @property
+    def error_rate(self):
+        return (self.failed + self.errors) / self.count if self.count else 0.0
+
+    def record(self, elapsed, outcome):
+        """Record execution, outcome is index in OUTCOMES"""
+        self.latency.record(elapsed)
+        if outcome == 0:
+            self.passed += 1
+        elif outcome == 1:
+            self.failed += 1
+        else:
+            self.errors += 1
+
+    def merge(self, other):
+        self.latency.merge(other.latency)
+        self.passed += other.passed
+        self.failed += other.failed
+        self.errors += other.errors
+        return self
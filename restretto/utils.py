@@ -2,37 +2,420 @@
 # -*- coding: utf-8 -*-
 
 
-import yaml
-from jinja2 import Template
+import re
+import importlib
+from functools import lru_cache
+from .errors import ParseError
 
 
-def apply_context(src, context={}):
+# max number of compiled templates kept in cache
+TEMPLATE_CACHE_SIZE = 4096
+
+
+# string consisting of single {{ expression }}, whitespace control markers are not part of it
+SINGLE_EXPRESSION = re.compile(r'^\{\{[-+]?((?:(?!\}\}|\{\{|\{%).)*?)-?\}\}$', re.DOTALL)
+
+
+@lru_cache(maxsize=None)
+def environment(native=False):
+    """Get shared jinja2 environment for all templates, jinja2 imported when required"""
+    if native:
+        from jinja2.nativetypes import NativeEnvironment
+        return NativeEnvironment()
+    from jinja2 import Environment
+    return Environment()
+
+
+def compile_template(src, native=True):
+    """Get compiled render function for source string, cached
+
+    Native render returns value of single expression as is and python
+    literals for other templates, otherwise rendered string is parsed
+    as YAML (compatibility mode).
+    """
+    return _compile_template(src, bool(native))
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def _compile_template(src, native):
+    if not native:
+        import yaml
+        template = environment().from_string(src)
+        return lambda context: yaml.full_load(template.render(context))
+    match = SINGLE_EXPRESSION.match(src)
+    if match:
+        return environment(native=True).compile_expression(match.group(1))
+    return environment(native=True).from_string(src).render
+
+
+# statistics of compiled templates cache
+template_cache_info = _compile_template.cache_info
+
+
+def is_templated(src):
+    """True if nested dicts/lists contain templates"""
+    if type(src) is dict:
+        return any(is_templated(v) for v in src.values())
+    elif type(src) is list:
+        return any(is_templated(item) for item in src)
+    return type(src) is str and "{{" in src
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def template_variables(src):
+    """Get names of context variables referenced by template"""
+    from jinja2 import meta
+    return frozenset(meta.find_undeclared_variables(environment().parse(src)))
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def template_calls(src):
+    """True if template calls filters or functions, which may give other result for the same variables"""
+    from jinja2 import nodes
+    return any(True for node in environment().parse(src).find_all((nodes.Filter, nodes.Call)))
+
+
+def referenced_variables(src):
+    """Get names of context variables referenced by templates in nested dicts/lists"""
+    if type(src) is dict:
+        return frozenset().union(*(referenced_variables(v) for v in src.values()))
+    elif type(src) is list:
+        return frozenset().union(*(referenced_variables(item) for item in src))
+    elif type(src) is str and "{{" in src:
+        return template_variables(src)
+    return frozenset()
+
+
+# value of variable missing in context
+MISSING = object()
+# types of variables values, renders are memoized for
+IMMUTABLE_TYPES = frozenset((str, int, float, bool, type(None)))
+
+
+class TemplateSlot(object):
+    """Templated string, rendered again only if variables it uses change
+
+    Templates calling filters or functions (random, lipsum, cycler, ...)
+    are rendered every time.
+    """
+
+    def __init__(self, src, native=True):
+        self.src = src
+        self.render = compile_template(src, native)
+        self.variables = tuple(sorted(template_variables(src)))
+        self.memoized = not template_calls(src)
+        # (values of variables, rendered) of the last render
+        self.last = None
+
+    def __call__(self, context):
+        values = tuple(context.get(name, MISSING) for name in self.variables)
+        # mutable values may be changed in place, they are never memoized
+        key = None
+        if self.memoized and all(v is MISSING or type(v) in IMMUTABLE_TYPES for v in values):
+            key = tuple((type(v), v) for v in values)
+            last = self.last
+            if last is not None and last[0] == key:
+                return last[1]
+        # only used variables are given, jinja2 copies context on each render
+        rendered = self.render({
+            name: value for (name, value) in zip(self.variables, values) if value is not MISSING
+        })
+        if key is not None:
+            self.last = (key, rendered)
+        return rendered
+
+
+class ContextTemplate(object):
+    """Nested dicts/lists with templated strings, compiled to slots
+
+    Only templated strings are rendered, dicts and lists on the way to
+    them are copied, while untouched subtrees are shared with source.
+    """
+
+    def __init__(self, src, native=True):
+        self.src = src
+        # [(path, slot)] for all templated strings
+        self.slots = []
+        self.renderer = self._compile(src, (), native)
+
+    def _compile(self, src, path, native):
+        """Get render function for src, None if it has no templates"""
+        if type(src) is str:
+            if "{{" not in src:
+                return None
+            slot = TemplateSlot(src, native)
+            self.slots.append((path, slot))
+            return slot
+        if type(src) is dict:
+            items = src.items()
+        elif type(src) is list:
+            items = enumerate(src)
+        else:
+            return None
+        children = []
+        for (key, value) in items:
+            renderer = self._compile(value, path + (key, ), native)
+            if renderer is not None:
+                children.append((key, renderer))
+        if not children:
+            return None
+        container = type(src)
+
+        def render(context):
+            result = container(src)
+            for (key, renderer) in children:
+                result[key] = renderer(context)
+            return result
+        return render
+
+    @property
+    def variables(self):
+        """Names of context variables used by templates"""
+        return frozenset(name for (path, slot) in self.slots for name in slot.variables)
+
+    def render(self, context={}):
+        """Get source with templates rendered, which can share parts with source"""
+        if self.renderer is None:
+            return self.src
+        return self.renderer(context)
+
+
+def apply_context(src, context={}, native=True):
     """Apply context to dict"""
     result = None
     if type(src) is dict:
         # traverse nested dict
         result = {}
         for (k, v) in src.items():
-            result[k] = apply_context(v, context)
+            result[k] = apply_context(v, context, native)
     elif type(src) is list:
         # traverse list recursively
         result = []
         for i, item in enumerate(src):
-            result.append(apply_context(item, context))
+            result.append(apply_context(item, context, native))
     elif type(src) is str and "{{" in src:
         #just apply template if string contains var
-        result = yaml.full_load(Template(src).render(context))
+        result = compile_template(src, native)(context)
     else:
         # integers/boolean and other non-templatable types
         result = src
     return result
 
 
+# json decoders modules, in order of preference
+JSON_DECODERS = ('orjson', 'ujson', 'json')
+
+# decoder used when not set explicitly
+default_json_decoder = None
+
+
+@lru_cache(maxsize=None)
+def json_decoder(name=None):
+    """Get loads function of json decoder module, fastest available if not given"""
+    if name:
+        return importlib.import_module(name).loads
+    if default_json_decoder:
+        return json_decoder(default_json_decoder)
+    for name in JSON_DECODERS:
+        try:
+            return importlib.import_module(name).loads
+        except ImportError:
+            continue
+
+
+def set_json_decoder(name):
+    """Set default json decoder, ImportError raised if it's not available"""
+    global default_json_decoder
+    json_decoder(name)
+    default_json_decoder = name
+    json_decoder.cache_clear()
+
+
+class DecodedResponse(object):
+    """Response proxy, decoding json body at most once"""
+
+    def __init__(self, response, loads=None):
+        self.response = response
+        self.loads = loads or json_decoder()
+        self._decoded = False
+        self._json = None
+        self._error = None
+
+    def __getattr__(self, name):
+        return getattr(self.response, name)
+
+    def __bool__(self):
+        return bool(self.response)
+
+    def json(self):
+        if not self._decoded:
+            self._decoded = True
+            try:
+                self._json = self.loads(self.response.content)
+            except ValueError as error:
+                self._error = error
+        if self._error is not None:
+            raise self._error
+        return self._json
+
+
+# path fragments: bracketed [...] or dot separated names
+PATH_FRAGMENT = re.compile(r'\[([^\]]*)\]|([^.\[]+)')
+PATH_SLICE = re.compile(r'^(-?\d*):(-?\d*)(?::(-?\d+))?$')
+PATH_FILTER = re.compile(r'^\?\s*([^=!]+?)\s*(?:(!?=)\s*(.*?))?\s*$')
+
+
+# types of filter values compared as typed
+FILTER_TYPES = (str, int, float, bool, type(None))
+
+
+class JsonPath(object):
+    """Compiled property path
+
+    Path fragments are separated by dots, each one is a key or list index,
+    `*` (all items), `start:stop[:step]` (list slice, key of other values)
+    or `?key`, `?key=value`, `?key!=value` (list items filter). Fragments
+    containing dots should be put in brackets: json.items[?price=1.5].id.
+    Filter values are yaml scalars compared with their types: true, null,
+    1.5 or string, quoted if it looks like other ones: "1.5". Path with
+    any of wildcard, slice or filter gives list of all matched values.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.steps = tuple(self._compile(frag) for frag in self._split(path))
+        # fanout is None for slices, which fan out over lists only
+        self.multiple = any(fanout is not False for (step, fanout) in self.steps)
+
+    def __repr__(self):
+        return 'JsonPath({!r})'.format(self.path)
+
+    @staticmethod
+    def _split(path):
+        fragments = []
+        for match in PATH_FRAGMENT.finditer(path):
+            fragment = match.group(1) if match.group(1) is not None else match.group(2)
+            fragments.append(fragment.strip())
+        return fragments
+
+    def _compile(self, fragment):
+        """Get (step function, is fanout) for path fragment"""
+        if fragment == '*':
+            return (self._all, True)
+        slice_match = PATH_SLICE.match(fragment)
+        if slice_match:
+            bounds = (int(b) if b else None for b in slice_match.groups())
+            return (self._slice(slice(*bounds), fragment), None)
+        if fragment.startswith('?'):
+            filter_match = PATH_FILTER.match(fragment)
+            if not filter_match:
+                raise ParseError('Invalid path fragment: {}'.format(fragment))
+            (key, op, value) = filter_match.groups()
+            return (self._filter(key, op, value), True)
+        return (self._key(fragment), False)
+
+    @staticmethod
+    def _all(src):
+        if isinstance(src, dict):
+            return list(src.values())
+        return list(src) if isinstance(src, list) else []
+
+    @staticmethod
+    def _slice(bounds, fragment):
+        """Get step returning (slice of list, True) or (value of key, False)"""
+        def step(src):
+            return (src[bounds], True) if isinstance(src, list) else (src[fragment], False)
+        return step
+
+    @staticmethod
+    def _filter_value(value):
+        """Parse filter value as yaml scalar: true, null, 1.5 or (quoted) string"""
+        import yaml
+        if not value:
+            return value
+        try:
+            parsed = yaml.safe_load(value)
+        except yaml.YAMLError:
+            return value
+        # dates and collections are compared as given
+        return parsed if type(parsed) in FILTER_TYPES else value
+
+    @classmethod
+    def _filter(cls, key, op, value):
+        expected = cls._filter_value(value)
+
+        def equal(actual):
+            if type(expected) is str:
+                return type(actual) is str and actual == expected
+            if type(expected) in (bool, type(None)):
+                return actual is expected
+            # numbers, but not bools, which are ints too
+            return type(actual) in (int, float) and actual == expected
+
+        def matches(item):
+            if not isinstance(item, dict) or key not in item:
+                return False
+            if op is None:
+                return True
+            return equal(item[key]) == (op == '=')
+
+        def step(src):
+            return [item for item in src if matches(item)] if isinstance(src, list) else []
+        return step
+
+    @staticmethod
+    def _key(fragment):
+        index = int(fragment) if fragment.lstrip('-').isdigit() else None
+
+        def step(src):
+            return src[index] if (index is not None and isinstance(src, list)) \
+                else src[fragment]
+        return step
+
+    def get(self, data):
+        """Extract value(s) by path from data"""
+        if not self.multiple:
+            for (step, fanout) in self.steps:
+                data = step(data)
+            return data
+        values = [data]
+        fanned = False
+        error = None
+        for (step, fanout) in self.steps:
+            if fanout:
+                values = [v for value in values for v in step(value)]
+                fanned = True
+                continue
+            matched = []
+            for value in values:
+                try:
+                    result = step(value)
+                except (LookupError, TypeError) as exc:
+                    # silently skip items without property
+                    error = exc
+                    continue
+                if fanout is None:
+                    (result, sliced) = result
+                    if sliced:
+                        matched.extend(result)
+                        fanned = True
+                        continue
+                matched.append(result)
+            values = matched
+        if fanned:
+            return values
+        if not values:
+            # path has single value, missing one is an error
+            raise error
+        return values[0]
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def compile_path(path):
+    """Get compiled property path, cached"""
+    return JsonPath(path)
+
+
 def json_path(path, data):
     """Extract property by path"""
-    fragments = path.split(".")
-    src = data
-    for p in fragments:
-        src = src[int(p)] if (isinstance(src, list) and p.isdigit()) \
-            else src[p]
-    return src
+    return compile_path(path).get(data)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Watch mode for restretto
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Keeps sessions loaded and reruns ones which spec or var files change.
+    Connection pools and compiled templates are shared between reruns.
+"""
+
+import os
+import time
+from .cache import read_stamped
+from .cli import paint, prewarm, report, run_sessions
+from .loader import find_files, parse
+from .rest import Session
+
+
+# time to collect events following the first one, ms
+INOTIFY_READ_DELAY = 100
+
+
+class Watcher(object):
+    """Tracks spec files under path and files they depend on
+
+    Uses inotify if inotify_simple is installed, polls files stamps with
+    given interval otherwise.
+    """
+
+    def __init__(self, path, interval=0.5):
+        self.path = path
+        self.interval = interval
+        # {spec path: {path of spec or var file: stamp}} for loaded specs
+        self.sources = {}
+        self.watched = set()
+        try:
+            from inotify_simple import INotify
+            self.inotify = INotify()
+        except (ImportError, OSError):
+            self.inotify = None
+
+    def changed(self, spec_path):
+        """True if spec or any of its var files changed since it was loaded"""
+        stamps = self.sources[spec_path]
+        for (path, (mtime, size, digest)) in stamps.items():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return True
+            if (stat.st_mtime_ns, stat.st_size) == (mtime, size):
+                continue
+            (content, stamp) = read_stamped(path)
+            if stamp[2] != digest:
+                return True
+            # touched, but not changed
+            stamps[path] = stamp
+        return False
+
+    def scan(self):
+        """Get (changed, removed) spec files since they were loaded"""
+        files = [f for f in find_files(self.path) if os.path.isfile(f)]
+        changed = [f for f in files if f not in self.sources or self.changed(f)]
+        removed = set(self.sources).difference(files)
+        for path in removed:
+            del self.sources[path]
+        return changed, removed
+
+    def load(self, path):
+        """Parse spec file, returns session or None for empty file"""
+        try:
+            (spec, stamps) = parse(path)
+        except Exception:
+            # keep files known so far, to retry when any of them changes
+            known = [f for f in self.sources.get(path, {}) if os.path.isfile(f)]
+            self.sources[path] = {f: read_stamped(f)[1] for f in set(known) | {path}}
+            raise
+        self.sources[path] = stamps
+        return Session(spec) if spec else None
+
+    def directories(self):
+        """Get directories containing watched files"""
+        if os.path.isdir(self.path):
+            result = {curdir for (curdir, subdirs, entries) in os.walk(self.path, followlinks=True)}
+        else:
+            result = {os.path.dirname(os.path.abspath(self.path))}
+        for stamps in self.sources.values():
+            result.update(os.path.dirname(os.path.abspath(f)) for f in stamps)
+        return result
+
+    def wait(self):
+        """Block until watched files may have changed"""
+        if self.inotify is not None:
+            try:
+                from inotify_simple import flags
+                mask = flags.CREATE | flags.CLOSE_WRITE | flags.MODIFY | flags.DELETE \
+                    | flags.MOVED_TO | flags.MOVED_FROM | flags.ATTRIB
+                # directories are watched, as editors often save by renaming
+                for directory in self.directories() - self.watched:
+                    self.inotify.add_watch(directory, mask)
+                    self.watched.add(directory)
+                self.inotify.read(read_delay=INOTIFY_READ_DELAY)
+                return
+            except OSError:
+                # out of watches or directory is gone, poll from now on
+                self.inotify.close()
+                self.inotify = None
+        time.sleep(self.interval)
+
+
+def watch(arguments, watcher=None):
+    """Run sessions, then rerun changed ones until interrupted"""
+    watcher = watcher or Watcher(arguments.path, arguments.watch_interval)
+    first = True
+    try:
+        while True:
+            (changed, removed) = watcher.scan()
+            sessions = []
+            for path in changed:
+                try:
+                    test_session = watcher.load(path)
+                except Exception as error:
+                    print("{} {}: {}".format(paint("yellow", "[ERROR]"), path, error))
+                    continue
+                if test_session:
+                    sessions.append(test_session)
+            if sessions:
+                if arguments.prewarm and arguments.engine == "sync" and not arguments.replay:
+                    prewarm(sessions, arguments)
+                report(run_sessions(sessions, arguments), arguments)
+            if changed or removed or first:
+                print("Watching {} for changes, press Ctrl+C to stop".format(arguments.path))
+            first = False
+            watcher.wait()
+    except KeyboardInterrupt:
+        pass
+    return 0
@@ -14,6 +14,7 @@ setup(
     packages=find_packages(),
     entry_points={"console_scripts": ["restretto = restretto.cli:main"]},
     install_requires=["requests>=2.7.0", "pyaml>=3.11", "jinja2>=2.8", "clint>=0.5"],
+    extras_require={"async": ["aiohttp>=3.0"], "watch": ["inotify_simple"]},
     classifiers=[
         "Development Status :: 5 - Production/Stable",
         "Environment :: Console",
@@ -4,9 +4,139 @@
     Unittests for restretto
 """
 
+import copy
+import hashlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import urlparse, parse_qsl
 import restretto
 import restretto.cli
+import restretto.loader
+import restretto.metrics
+import restretto.pools
+import restretto.profile
+import restretto.stats
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Minimal httpbin-like handler for offline tests"""
+
+    # keep connections open, so their reuse can be tested
+    protocol_version = 'HTTP/1.1'
+    # reply is sent at once, not delayed by Nagle's algorithm
+    wbufsize = 64 * 1024
+    disable_nagle_algorithm = True
+
+    # number of requests made to /ready/<n>?key=<key> by key
+    hits = {}
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status=200, payload=None, headers={}):
+        body = json.dumps(payload).encode() if payload is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for (name, value) in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_any(self):
+        url = urlparse(self.path)
+        args = dict(parse_qsl(url.query))
+        length = int(self.headers.get('Content-Length') or 0)
+        data = self.rfile.read(length).decode() if length else ''
+        if url.path.startswith('/status/'):
+            return self.reply(int(url.path.split('/')[-1]))
+        if url.path.startswith('/ready/'):
+            # unavailable for first n - 1 requests
+            hits = self.hits[args['key']] = self.hits.get(args['key'], 0) + 1
+            ready = hits >= int(url.path.split('/')[-1])
+            if args.get('body'):
+                # always 200, but body is not json at first, then misses state
+                if hits == 1 and not ready:
+                    self.send_response(200)
+                    self.send_header('Content-Length', '7')
+                    self.end_headers()
+                    return self.wfile.write(b'pending')
+                return self.reply(200, {'state': 'ready'} if ready else {})
+            return self.reply(200 if ready else 503)
+        if url.path.startswith('/delay/'):
+            time.sleep(float(url.path.split('/')[-1]))
+        if url.path == '/response-headers':
+            return self.reply(200, args, args)
+        if url.path.startswith('/chunked/'):
+            # body of n bytes of unknown length
+            size = int(url.path.split('/')[-1])
+            self.send_response(200)
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for offset in range(0, size, 4096):
+                chunk = b'x' * min(4096, size - offset)
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+            self.wfile.write(b'0\r\n\r\n')
+            return
+        try:
+            parsed = json.loads(data) if data else None
+        except ValueError:
+            parsed = None
+        self.reply(200, {
+            'args': args, 'headers': dict(self.headers), 'url': self.path,
+            'data': data, 'json': parsed
+        })
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_PATCH = handle_any
+
+
+class Server(ThreadingHTTPServer):
+
+    def handle_error(self, request, client_address):
+        # clients may close connections without reading whole response
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class CliMixin(object):
+    """Runs cli on sessions made by factory instead of loaded ones"""
+
+    def run_cli(self, sessions_factory, *args):
+        """Run cli with args given after path, returns (exit code, output)"""
+        out = io.StringIO()
+        with mock.patch.object(restretto.cli, 'load', side_effect=lambda *a: sessions_factory()), \
+                mock.patch('sys.stdout', out):
+            code = restretto.cli.main(['path'] + list(args))
+        return code, out.getvalue()
+
+
+class LocalServerMixin(CliMixin):
+    """Serves Handler on random local port for test case"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = Server(('127.0.0.1', 0), Handler)
+        cls.baseUri = 'http://127.0.0.1:{}/'.format(cls.server.server_port)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def session(self, resources, **spec):
+        spec.setdefault('baseUri', self.baseUri)
+        spec['resources'] = copy.deepcopy(resources)
+        return restretto.Session(spec)
 
 
 class ResourceTestCase(unittest.TestCase):
@@ -221,6 +351,43 @@ class AssertsTestCase(unittest.TestCase):
             assertion.test(resp)
 
 
+    def test_status_list_of_ints(self):
+        assertion = restretto.assertions.Assert([{'status': [400, '5xx']}])
+        self.assertTrue(assertion.test(self.Response(400)))
+        self.assertTrue(assertion.test(self.Response(503)))
+        with self.assertRaises(restretto.errors.ExpectError):
+            assertion.test(self.Response(401))
+
+    def test_statuses(self):
+        statuses = restretto.assertions.Statuses(['2xx', 304, '4?4'])
+        self.assertEqual(statuses.ranges, (range(200, 300),))
+        self.assertEqual(statuses.codes, frozenset([304]))
+        self.assertEqual([c in statuses for c in (200, 299, 304, 404, 414, 405)],
+                         [True, True, True, True, True, False])
+
+    def test_templated_operands(self):
+        spec = [
+            {'status': '{{code}}'},
+            {'header': 'X-Value', 'is': '{{value}}'},
+            {'body': 'text', 'contains': 'static'},
+        ]
+        assertion = restretto.assertions.Assert(spec)
+        checks = assertion.statements[2].checks
+        self.assertEqual([(value, template) for (check, value, template) in checks], [('static', None)])
+        self.assertIsNotNone(assertion.statements[1].checks[0][2])
+        resp = self.Response(201, headers={'X-Value': 'one'}, text='static text')
+        self.assertTrue(assertion.test(resp, {'code': 201, 'value': 'one'}))
+        with self.assertRaises(restretto.errors.ExpectError):
+            assertion.test(resp, {'code': 201, 'value': 'two'})
+        with self.assertRaises(restretto.errors.ExpectError):
+            assertion.test(resp, {'code': '4xx', 'value': 'one'})
+
+    def test_unknown_condition(self):
+        assertion = restretto.assertions.Assert([{'body': 'text', 'matches': 'x'}])
+        with self.assertRaises(restretto.errors.ParseError):
+            assertion.test(self.Response(200, text='x'))
+
+
 class TemplatingTestCase(unittest.TestCase):
 
     VARS = {
@@ -300,6 +467,179 @@ class TemplatingTestCase(unittest.TestCase):
         }
         self.assertEqual(result, expected)
 
+    def test_single_expression_native(self):
+        src = {'json': '{{ nested }}', 'items': '{{nested.obj.nested_items}}', 'quoted': "'{{val}}'"}
+        result = restretto.utils.apply_context(src, self.VARS)
+        self.assertIs(result['json'], self.VARS['nested'])
+        self.assertEqual(result['items'], ['a', 'b'])
+        self.assertEqual(result['quoted'], '100')
+
+    def test_whitespace_control(self):
+        src = ['{{- val -}}', '{{+ val }}', '{{ val - 1 -}}', '{{-val}}', 'v{{- val }}']
+        result = restretto.utils.apply_context(src, self.VARS)
+        self.assertEqual(result, [100, 100, 99, 100, 'v100'])
+
+    def test_native_types(self):
+        src = ['{{val}}{{val}}', '{{server}}:{{val}}', '{{missing}}', '{{ val + 1 }}']
+        result = restretto.utils.apply_context(src, self.VARS)
+        self.assertEqual(result, [100100, 'httpbin.org:100', None, 101])
+
+    def test_yaml_compat(self):
+        src = ['{{val}}', 'yes', '{{flag}}', '{{nested.obj.nested_items}}']
+        result = restretto.utils.apply_context(src, {'val': '12', 'flag': 'yes', 'nested': self.VARS['nested']}, False)
+        self.assertEqual(result, [12, 'yes', True, ['a', 'b']])
+
+    def test_session_templating_mode(self):
+        spec = {'templating': 'yaml', 'vars': {'n': '42'}, 'headers': {'X-N': '{{n}}'}, 'resources': ['/']}
+        session = restretto.Session(spec)
+        self.assertFalse(session.native)
+        self.assertFalse(session.resources[0].native)
+        self.assertTrue(restretto.Session({'resources': ['/']}).native)
+
+    def test_template_cache(self):
+        src = {'url': '{{scheme}}://{{server}}/cached'}
+        restretto.utils.apply_context(src, self.VARS)
+        hits = restretto.utils.template_cache_info().hits
+        result = restretto.utils.apply_context(src, {'scheme': 'https', 'server': 'local'})
+        self.assertEqual(result, {'url': 'https://local/cached'})
+        self.assertEqual(restretto.utils.template_cache_info().hits, hits + 1)
+
+    def test_session_precompiles_templates(self):
+        spec = {'resources': [{'get': '/{{precompiled}}', 'expect': [{'status': '{{code}}'}]}]}
+        restretto.Session(spec)
+        hits = restretto.utils.template_cache_info().hits
+        restretto.utils.compile_template('/{{precompiled}}')
+        restretto.utils.compile_template('{{code}}')
+        self.assertEqual(restretto.utils.template_cache_info().hits, hits + 2)
+
+
+class ContextTemplateTestCase(unittest.TestCase):
+
+    SRC = {
+        'url': '/items/{{id}}',
+        'json': {'static': {'large': list(range(100))}, 'user': {'name': '{{name}}', 'age': 3}},
+        'params': [1, '{{id}}-{{name}}'],
+    }
+
+    def test_slots(self):
+        template = restretto.utils.ContextTemplate(self.SRC)
+        self.assertEqual(
+            [(path, slot.variables) for (path, slot) in template.slots],
+            [(('url', ), ('id', )), (('json', 'user', 'name'), ('name', )), (('params', 1), ('id', 'name'))]
+        )
+        self.assertEqual(template.variables, {'id', 'name'})
+
+    def test_render_shares_static_parts(self):
+        template = restretto.utils.ContextTemplate(self.SRC)
+        rendered = template.render({'id': 5, 'name': 'bob', 'unused': object()})
+        self.assertEqual(rendered['url'], '/items/5')
+        self.assertEqual(rendered['json']['user'], {'name': 'bob', 'age': 3})
+        self.assertEqual(rendered['params'], [1, '5-bob'])
+        self.assertIs(rendered['json']['static'], self.SRC['json']['static'])
+        self.assertIsNot(rendered['json'], self.SRC['json'])
+        self.assertEqual(self.SRC['url'], '/items/{{id}}')
+        static = {'a': [1, {'b': 'c'}]}
+        self.assertIs(restretto.utils.ContextTemplate(static).render({}), static)
+
+    def test_memoized(self):
+        template = restretto.utils.ContextTemplate({'a': '{{x}}', 'b': '{{y}}'})
+        (slot_a, slot_b) = (slot for (path, slot) in template.slots)
+        with mock.patch.object(slot_a, 'render', wraps=slot_a.render) as render_a, \
+                mock.patch.object(slot_b, 'render', wraps=slot_b.render) as render_b:
+            self.assertEqual(template.render({'x': 1, 'y': [1]}), {'a': 1, 'b': [1]})
+            self.assertEqual(template.render({'x': 1, 'y': [1]}), {'a': 1, 'b': [1]})
+            # equal, but of other type
+            self.assertEqual(template.render({'x': True, 'y': [2]}), {'a': True, 'b': [2]})
+        # mutable values are never memoized
+        self.assertEqual((render_a.call_count, render_b.call_count), (2, 3))
+
+    def test_calls_not_memoized(self):
+        template = restretto.utils.ContextTemplate({'id': '{{ range(1000000) | random }}', 'n': '{{ n | int }}', 'v': '{{ n }}'})
+        self.assertEqual([slot.memoized for (path, slot) in template.slots], [False, False, True])
+        ids = {template.render({'n': '1'})['id'] for i in range(5)}
+        self.assertGreater(len(ids), 1)
+
+    def test_yaml_mode(self):
+        template = restretto.utils.ContextTemplate({'a': '{{x}}', 'b': 'v{{x}}'}, native=False)
+        self.assertEqual(template.render({'x': 15}), {'a': 15, 'b': 'v15'})
+
+
+class JsonPathTestCase(unittest.TestCase):
+
+    DATA = {'json': {
+        'items': [
+            {'id': 1, 'status': 'active', 'price': 1.5, 'tags': ['a']},
+            {'id': 2, 'status': 'closed', 'price': 3},
+            {'id': 3, 'status': 'active', 'price': 1.5, 'tags': ['b', 'c']},
+        ],
+        'meta': {'total': 3, 'page': 1}
+    }}
+
+    def path(self, path):
+        return restretto.utils.json_path(path, self.DATA)
+
+    def test_plain(self):
+        self.assertEqual(self.path('json.meta.total'), 3)
+        self.assertEqual(self.path('json.items.1.id'), 2)
+        self.assertEqual(self.path('json.items[-1].id'), 3)
+        with self.assertRaises(KeyError):
+            self.path('json.missing')
+        with self.assertRaises(IndexError):
+            self.path('json.items.5')
+
+    def test_wildcard(self):
+        self.assertEqual(self.path('json.items.*.id'), [1, 2, 3])
+        self.assertEqual(self.path('json.meta.*'), [3, 1])
+        self.assertEqual(self.path('json.items.*.tags.*'), ['a', 'b', 'c'])
+
+    def test_slice(self):
+        self.assertEqual(self.path('json.items.1:.id'), [2, 3])
+        self.assertEqual(self.path('json.items[::2].id'), [1, 3])
+
+    def test_filter(self):
+        self.assertEqual(self.path('json.items[?status=active].id'), [1, 3])
+        self.assertEqual(self.path('json.items[?status!=active].id'), [2])
+        self.assertEqual(self.path('json.items[?tags].id'), [1, 3])
+        self.assertEqual(self.path('json.items[?price=1.5].id'), [1, 3])
+
+    def test_typed_filter(self):
+        data = {'json': [
+            {'id': 1, 'on': True, 'x': None, 'n': 1, 'code': '1'},
+            {'id': 2, 'on': False, 'x': 0, 'n': 1.0, 'code': 1},
+        ]}
+        get = restretto.utils.json_path
+        self.assertEqual(get('json[?on=true].id', data), [1])
+        self.assertEqual(get('json[?on=True].id', data), [1])
+        self.assertEqual(get('json[?on!=true].id', data), [2])
+        self.assertEqual(get('json[?x=null].id', data), [1])
+        self.assertEqual(get('json[?n=1].id', data), [1, 2])
+        self.assertEqual(get('json[?code="1"].id', data), [1])
+        self.assertEqual(get('json[?code=1].id', data), [2])
+
+    def test_invalid_filter(self):
+        with self.assertRaisesRegex(restretto.errors.ParseError, 'Invalid path fragment'):
+            restretto.utils.compile_path('json.items[?]')
+        with self.assertRaises(restretto.errors.ParseError):
+            restretto.Resource({'get': '/', 'vars': {'x': 'json.items[?]'}})
+
+    def test_slice_like_key(self):
+        data = {'json': {'10:30': 'morning', 'items': [1, 2, 3]}}
+        self.assertEqual(restretto.utils.json_path('json.10:30', data), 'morning')
+        self.assertEqual(restretto.utils.json_path('json[10:30]', data), 'morning')
+        self.assertEqual(restretto.utils.json_path('json.items.1:', data), [2, 3])
+        with self.assertRaises(KeyError):
+            restretto.utils.json_path('json.meta.1:2', {'json': {'meta': {}}})
+
+    def test_compiled_once(self):
+        self.assertIs(restretto.utils.compile_path('json.a.b'), restretto.utils.compile_path('json.a.b'))
+
+    def test_body_assertion(self):
+        spec = [{'body': 'json', 'property': 'json.items.*.id', 'contains': 2}]
+        assertion = restretto.assertions.Assert(spec)
+        response = mock.Mock(status_code=200, json=lambda: self.DATA['json'])
+        self.assertTrue(assertion.test(response))
+
+
 class LoaderFileLoadTestCase(unittest.TestCase):
 
     def test_load_unexisting_file(self):
@@ -327,6 +667,63 @@ class LoaderFileLoadTestCase(unittest.TestCase):
         self.assertFalse(data)
 
 
+class LoaderCacheTestCase(unittest.TestCase):
+
+    SPEC = "title: cached\nvars: vars.yml\nresources:\n  - /{{path}}\n"
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.tmpdir.name, 'cache')
+        self.spec_path = self.write('spec.yml', self.SPEC)
+        self.write('vars.yml', 'path: one\n')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write(self, name, content):
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, 'w') as target:
+            target.write(content)
+        return path
+
+    def load(self):
+        with mock.patch('restretto.loader.parse', wraps=restretto.loader.parse) as parse:
+            sessions = restretto.load(self.spec_path, self.cache_dir)
+        return sessions, parse.call_count
+
+    def test_cached(self):
+        (sessions, parsed) = self.load()
+        self.assertEqual(parsed, 1)
+        (cached, parsed) = self.load()
+        self.assertEqual(parsed, 0)
+        self.assertEqual(cached[0].spec, sessions[0].spec)
+
+    def test_touched_unchanged(self):
+        self.load()
+        os.utime(self.spec_path, ns=(1, 1))
+        self.assertEqual(self.load()[1], 0)
+
+    def test_changed(self):
+        self.load()
+        self.write('spec.yml', self.SPEC.replace('cached', 'changed'))
+        os.utime(self.spec_path, ns=(2, 2))
+        (sessions, parsed) = self.load()
+        self.assertEqual(parsed, 1)
+        self.assertEqual(sessions[0].title, 'changed')
+
+    def test_var_file_changed(self):
+        self.load()
+        os.utime(self.write('vars.yml', 'path: two\n'), ns=(3, 3))
+        (sessions, parsed) = self.load()
+        self.assertEqual(parsed, 1)
+        self.assertEqual(sessions[0].context['path'], 'two')
+
+    def test_empty_file_cached(self):
+        self.write('spec.yml', '')
+        self.assertEqual(self.load(), ([], 1))
+        self.assertEqual(self.load(), ([], 0))
+
+
 class LoaderDirLoadTestCase(unittest.TestCase):
 
     def test_load_from_dir(self):
@@ -377,5 +774,875 @@ class OptionsTestCase(unittest.TestCase):
             restretto.cli.options(" = ")
 
 
+class CliJobsTestCase(CliMixin, unittest.TestCase):
+
+    class Session(object):
+        """Stub session, resources are outcomes: None, failure or error"""
+
+        def __init__(self, title, outcomes):
+            self.title = title
+            self.resources = [
+                mock.Mock(title='{} #{}'.format(title, i), outcome=outcome, response=None, timings={})
+                for i, outcome in enumerate(outcomes)
+            ]
+            self.executed = []
+            self.filename = title + '.yml'
+
+        def test(self, resource, context=None):
+            self.executed.append(resource.title)
+            if resource.outcome:
+                raise resource.outcome
+            return resource
+
+    def sessions(self):
+        return [
+            self.Session('one', [None, None]),
+            self.Session('two', [restretto.errors.ExpectError('bad'), None]),
+            self.Session('three', [ValueError('oops')]),
+            self.Session('four', [None, None, None]),
+        ]
+
+    def test_parallel_output_matches_sequential(self):
+        (seq_code, seq_out) = self.run_cli(self.sessions)
+        (par_code, par_out) = self.run_cli(self.sessions, '--jobs', '3')
+        self.assertEqual(seq_code, 1)
+        self.assertEqual(par_code, seq_code)
+        self.assertEqual(par_out, seq_out)
+        self.assertIn('Total: 8 / Passed: ', par_out)
+
+    def test_resources_order_kept(self):
+        sessions = self.sessions()
+        self.run_cli(lambda: sessions, '-j', '4')
+        for session in sessions:
+            self.assertEqual(session.executed, [r.title for r in session.resources])
+
+    def test_bad_jobs(self):
+        with self.assertRaises(restretto.cli.ArgumentTypeError):
+            restretto.cli.positive('0')
+
+
+class ShardTestCase(CliMixin, unittest.TestCase):
+
+    Session = CliJobsTestCase.Session
+
+    def sessions(self):
+        return [self.Session(name, [None] * size) for (name, size) in
+                [('a', 1), ('b', 5), ('c', 2), ('d', 2), ('e', 3), ('f', 1)]]
+
+    def titles(self, shards):
+        return [[s.title for s in shard] for shard in shards]
+
+    def test_parse(self):
+        from restretto.shard import shard
+        self.assertEqual(shard('2/3'), (2, 3))
+        for encoded in ('0/3', '4/3', '1', 'a/b'):
+            with self.assertRaises(restretto.cli.ArgumentTypeError):
+                shard(encoded)
+
+    def test_split(self):
+        from restretto.shard import split
+        # by resources count
+        self.assertEqual(self.titles(split(self.sessions(), 2)), [['b', 'd'], ['a', 'c', 'e', 'f']])
+        # known durations take precedence, unknown are guessed by known rate
+        durations = {'b.yml': 1.0, 'e.yml': 6.0}
+        shards = self.titles(split(self.sessions(), 3, durations))
+        self.assertEqual(shards, [['e'], ['b', 'c'], ['a', 'd', 'f']])
+        # loading order doesn't matter
+        self.assertEqual(self.titles(split(self.sessions()[::-1], 3, durations)), [s[::-1] for s in shards])
+        self.assertEqual(self.titles(split(self.sessions()[:1], 3)), [['a'], [], []])
+
+    def test_shards_merged(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            reports = []
+            for index in (1, 2):
+                reports.append(os.path.join(tmpdir, '{}.json'.format(index)))
+                self.run_cli(self.sessions, '--shard', '{}/2'.format(index), '--report', reports[-1])
+            merged = os.path.join(tmpdir, 'merged.json')
+            durations = os.path.join(tmpdir, 'durations.json')
+            out = io.StringIO()
+            with mock.patch('sys.stdout', out):
+                code = restretto.cli.main(['merge', '-o', merged, '--durations', durations] + reports)
+            self.assertEqual(code, 0)
+            self.assertIn('Total: 14 / Passed: 14', out.getvalue())
+            with open(merged) as source:
+                self.assertEqual(sorted(s['title'] for s in json.load(source)['sessions']), list('abcdef'))
+            with open(durations) as source:
+                self.assertEqual(sorted(json.load(source)), [c + '.yml' for c in 'abcdef'])
+
+
+class DecodedResponseTestCase(LocalServerMixin, unittest.TestCase):
+
+    def test_decoded_once(self):
+        loads = mock.Mock(return_value={'key': 'value'})
+        response = restretto.utils.DecodedResponse(mock.Mock(content=b'{}', status_code=200), loads)
+        self.assertEqual(response.json(), {'key': 'value'})
+        self.assertEqual(response.json(), {'key': 'value'})
+        self.assertEqual(response.status_code, 200)
+        loads.assert_called_once_with(b'{}')
+
+    def test_decode_error_cached(self):
+        loads = mock.Mock(side_effect=ValueError('bad json'))
+        response = restretto.utils.DecodedResponse(mock.Mock(content=b'{'), loads)
+        for i in range(2):
+            with self.assertRaises(ValueError):
+                response.json()
+        loads.assert_called_once_with(b'{')
+
+    def test_decoder_choice(self):
+        import json as stdlib_json
+        self.assertIs(restretto.utils.json_decoder('json'), stdlib_json.loads)
+        self.assertTrue(callable(restretto.utils.json_decoder()))
+        with self.assertRaises(ImportError):
+            restretto.utils.json_decoder('no_such_json_module')
+
+    def test_resource_shares_decoded_body(self):
+        session = self.session([{
+            'get': '/get?a=1',
+            'vars': {'a': 'json.args.a'},
+            'expect': [
+                {'body': 'json'},
+                {'body': 'json', 'property': 'json.args.a', 'is': '1'},
+                {'body': 'json', 'property': 'json.url', 'contains': 'get'},
+            ]
+        }], json_decoder='json')
+        loads = mock.Mock(side_effect=json.loads)
+        with mock.patch.object(restretto.rest, 'json_decoder', return_value=loads) as decoder:
+            session.test(session.resources[0])
+        decoder.assert_called_once_with('json')
+        self.assertEqual(loads.call_count, 1)
+        self.assertEqual(session.context['a'], '1')
+
+
+class DownloadTestCase(LocalServerMixin, unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'body.json')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_streaming_download(self):
+        session = self.session([{
+            'get': '/get?payload=data',
+            'download': {'path': self.path, 'chunk_size': 16, 'checksum': 'sha256'},
+            'expect': [
+                {'status': 200},
+                {'download': 'size', 'is': '{{size}}'},
+                {'download': 'checksum', 'is': '{{checksum}}'},
+            ]
+        }])
+        resource = session.resources[0]
+        self.assertTrue(resource.stream)
+        # get expected values from plain request
+        content = restretto.Session({'resources': []}).http.get(self.baseUri + 'get?payload=data').content
+        context = {'size': len(content), 'checksum': hashlib.sha256(content).hexdigest()}
+        session.test(resource, context)
+        with open(self.path, 'rb') as downloaded:
+            self.assertEqual(downloaded.read(), content)
+        self.assertEqual(resource.downloaded['size'], len(content))
+        # body is never buffered in memory
+        self.assertFalse(resource.response.response._content)
+
+    def test_download_assertion_fails(self):
+        session = self.session([{
+            'get': '/get', 'download': self.path,
+            'expect': [{'download': 'size', 'is': 1}]
+        }])
+        with self.assertRaises(restretto.errors.ExpectError):
+            session.test(session.resources[0])
+
+    def test_failed_before_download_releases_connection(self):
+        from urllib3.connection import HTTPConnection
+        restretto.pools.configure()
+        self.addCleanup(restretto.pools.configure)
+        session = self.session([{'get': '/get', 'download': self.path, 'expect': [{'status': 201}]}] * 3)
+        with mock.patch.object(HTTPConnection, 'connect', autospec=True, side_effect=HTTPConnection.connect) as connect:
+            for resource in session.resources:
+                with self.assertRaises(restretto.errors.ExpectError):
+                    session.test(resource)
+        self.assertEqual(connect.call_count, 1)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_buffered_when_body_asserted(self):
+        session = self.session([{
+            'get': '/get?a=b', 'download': self.path,
+            'expect': [{'body': 'json', 'property': 'json.args.a', 'is': 'b'}]
+        }])
+        resource = session.resources[0]
+        self.assertFalse(resource.stream)
+        session.test(resource)
+        self.assertTrue(os.path.getsize(self.path))
+        self.assertIsNone(resource.downloaded['checksum'])
+
+    def test_bad_checksum(self):
+        with self.assertRaises(restretto.errors.ParseError):
+            restretto.Resource({'get': '/', 'download': {'path': 'x', 'checksum': 'nope'}})
+
+
+class TimingsTestCase(LocalServerMixin, unittest.TestCase):
+
+    PHASES = {'wall', 'ttfb', 'transfer', 'templating', 'assertions'}
+
+    def test_resource_timings(self):
+        session = self.session([{'get': '/get?a={{a}}', 'expect': [{'status': 200}]}], vars={'a': 1})
+        resource = session.test(session.resources[0])
+        self.assertEqual(set(resource.timings), self.PHASES)
+        self.assertGreaterEqual(resource.timings['wall'], resource.timings['ttfb'])
+
+    def test_report(self):
+        session = self.session([{'get': '/get'}, {'wait': 0}, {'get': '/status/500'}], title='report')
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'report.json')
+            (code, output) = self.run_cli(lambda: [session], '--timings', '--report', path)
+            with open(path) as report_file:
+                report = json.load(report_file)
+        self.assertIn('[TIME]', output)
+        self.assertEqual((report['passed'], report['failed'], report['errors']), (2, 1, 0))
+        resources = report['sessions'][0]['resources']
+        self.assertEqual([r['outcome'] for r in resources], ['passed', 'passed', 'failed'])
+        self.assertEqual(resources[2]['status'], 500)
+        self.assertEqual(set(resources[0]['timings']), self.PHASES)
+
+
+class ResultTestCase(LocalServerMixin, unittest.TestCase):
+
+    def test_executions_are_independent(self):
+        session = self.session([{
+            'get': '/get?v={{v}}', 'vars': {'got': 'json.args.v'},
+            'expect': [{'body': 'json', 'property': 'json.args.v', 'is': '{{expected}}'}]
+        }])
+        resource = session.resources[0]
+        request = copy.deepcopy(resource.request)
+        from concurrent.futures import ThreadPoolExecutor
+        contexts = [{'v': i, 'expected': str(i if i % 3 else -1)} for i in range(12)]
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            results = list(pool.map(lambda c: resource.execute(self.baseUri, c, session.http), contexts))
+        # failed ones don't bind vars
+        self.assertEqual([r.vars.get('got') for r in results], [str(i) if i % 3 else None for i in range(12)])
+        self.assertEqual([r.passed for r in results], [bool(i % 3) for i in range(12)])
+        self.assertTrue(results[1].title.endswith('/get?v=1'))
+        # plan is not changed, nothing is kept by execute
+        self.assertEqual(resource.request, request)
+        self.assertIsNone(resource.last)
+        self.assertEqual(resource.timings, {})
+
+    def test_fork(self):
+        session = self.session([{'get': '/get?v={{v}}', 'vars': {'got': 'json.args.v'}}], vars={'v': 1})
+        forked = session.fork({'v': 2})
+        self.assertIs(forked.resources, session.resources)
+        self.assertIsNot(forked.http, session.http)
+        result = forked.execute(forked.resources[0])
+        self.assertEqual(forked.context['got'], '2')
+        self.assertNotIn('got', session.context)
+        self.assertIsNone(result.error)
+
+
+class PollingTestCase(LocalServerMixin, unittest.TestCase):
+
+    def test_polls_until_passed(self):
+        session = self.session([{
+            'get': '/ready/3?key=sync', 'wait_until': {'timeout': 5, 'interval': 0.01},
+            'expect': [{'status': 200}]
+        }])
+        resource = session.test(session.resources[0])
+        self.assertEqual(resource.attempts, 3)
+        self.assertIn('polling', resource.timings)
+
+    def test_timeout(self):
+        session = self.session([{'get': '/status/503', 'wait_until': {'timeout': 0.2, 'interval': 0.05}}])
+        start = time.perf_counter()
+        with self.assertRaises(restretto.errors.ExpectError):
+            session.test(session.resources[0])
+        self.assertGreaterEqual(time.perf_counter() - start, 0.2)
+        self.assertGreater(session.resources[0].attempts, 2)
+
+    def test_polls_until_property_is_there(self):
+        session = self.session([{
+            'get': '/ready/3?key=property&body=1', 'wait_until': {'timeout': 5, 'interval': 0.01},
+            'expect': [{'body': 'json', 'property': 'json.state', 'is': 'ready'}]
+        }, {
+            'get': '/ready/3?key=vars&body=1', 'wait_until': {'timeout': 5, 'interval': 0.01},
+            'vars': {'state': 'json.state'}
+        }])
+        for resource in session.resources:
+            self.assertEqual(session.test(resource).attempts, 3)
+        self.assertEqual(session.context['state'], 'ready')
+
+    def test_missing_property_times_out(self):
+        session = self.session([{
+            'get': '/get', 'wait_until': {'timeout': 0.1, 'interval': 0.02},
+            'expect': [{'body': 'json', 'property': 'json.state', 'is': 'ready'}]
+        }])
+        with self.assertRaises(KeyError):
+            session.test(session.resources[0])
+        self.assertGreater(session.resources[0].attempts, 1)
+
+    def test_errors_are_not_retried(self):
+        session = self.session([{'get': 'http://127.0.0.1:1/', 'wait_until': 5}])
+        with self.assertRaises(Exception):
+            session.test(session.resources[0])
+        self.assertEqual(session.resources[0].attempts, 1)
+
+    def test_delays(self):
+        polling = restretto.rest.Polling({
+            'timeout': 60, 'interval': 0.1, 'backoff': 2, 'max_interval': 0.3, 'jitter': 0.5
+        })
+        delays = polling.delays(rand=lambda: 0.5)
+        self.assertEqual([next(delays) for i in range(4)], [0.1, 0.2, 0.3, 0.3])
+        delays = polling.delays(rand=lambda: 1.0)
+        self.assertAlmostEqual(next(delays), 0.15)
+        self.assertEqual(list(restretto.rest.Polling(0).delays()), [None])
+
+    def test_invalid(self):
+        for spec in ({'interval': 1}, 'soon', {'timeout': 1, 'backoff': 0.5}, {'timeout': 1, 'jitter': 2}):
+            with self.assertRaises(restretto.errors.ParseError):
+                restretto.Resource({'get': '/', 'wait_until': spec})
+
+    def test_async(self):
+        try:
+            import asyncio
+            from restretto.aio import Client
+        except ImportError:
+            self.skipTest('aiohttp is not installed')
+        session = self.session([{
+            'get': '/ready/2?key=async', 'wait_until': {'timeout': 5, 'interval': 0.01},
+            'expect': [{'status': 200}]
+        }])
+
+        async def run():
+            client = Client()
+            http = client.session()
+            try:
+                return await session.atest(session.resources[0], http=http)
+            finally:
+                await http.close()
+                await client.close()
+        self.assertEqual(asyncio.run(run()).attempts, 2)
+
+
+class DependenciesTestCase(LocalServerMixin, unittest.TestCase):
+
+    RESOURCES = [
+        {'title': 'a', 'get': '/delay/0.2?v=1', 'vars': {'first': 'json.args.v'}},
+        {'title': 'b', 'get': '/delay/0.2?v={{static}}'},
+        {'title': 'c', 'get': '/delay/0.2?v={{first}}', 'vars': {'second': 'json.args.v'}},
+        {'title': 'd', 'get': '/delay/0.2',
+         'expect': [{'body': 'json', 'property': 'json.url', 'contains': '{{static}}'}]},
+        {'title': 'e', 'get': '/get?v={{second}}', 'vars': {'static': 'json.args.v'}},
+        {'wait': 0},
+        {'title': 'g', 'get': '/status/500'},
+        {'title': 'h', 'get': '/get', 'barrier': True},
+        {'title': 'i', 'get': '/get'},
+    ]
+
+    def test_dependencies(self):
+        session = self.session(self.RESOURCES, vars={'static': 'x'})
+        expected = [set(), set(), {0}, set(), {1, 2, 3}, {0, 1, 2, 3, 4}, {5}, set(range(7)), {7}]
+        self.assertEqual(session.dependencies(), expected)
+
+    def test_concurrent_run(self):
+        session = self.session(self.RESOURCES, vars={'static': 'delay'})
+        start = time.perf_counter()
+        results = list(session.test_all(workers=4))
+        elapsed = time.perf_counter() - start
+        self.assertEqual([r.title for (r, e) in results][:5], ['a', 'b', 'c', 'd', 'e'])
+        self.assertEqual([e is None for (r, e) in results], [True] * 6 + [False, True, True])
+        self.assertEqual(session.context['second'], '1')
+        self.assertEqual(session.context['static'], '1')
+        # a and c are the longest chain
+        self.assertLess(elapsed, 0.6)
+
+
+class WatchTestCase(LocalServerMixin, unittest.TestCase):
+
+    def write(self, name, content):
+        with open(os.path.join(self.tmpdir, name), 'w') as target:
+            target.write(content)
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.tmpdir = self.tmp.name
+        self.addCleanup(self.tmp.cleanup)
+        spec = "title: {}\nbaseUri: " + self.baseUri + "\nvars: {}\nresources:\n  - /get?v={{{{v}}}}\n"
+        self.write('one.yml', spec.format('one', 'vars.yml'))
+        self.write('two.yml', spec.format('two', '{v: 2}'))
+        self.write('vars.yml', 'v: 1\n')
+
+    def run_watch(self, *changes):
+        """Run watch, applying changes while waiting, returns titles of runs"""
+        from restretto import watch
+        runs = []
+
+        def run_sessions(sessions, arguments):
+            runs.append(sorted(s.title for s in sessions))
+            return restretto.cli.run_sessions(sessions, arguments)
+
+        def wait():
+            if not changes:
+                raise KeyboardInterrupt
+            changes.pop(0)()
+
+        changes = list(changes)
+        watcher = watch.Watcher(self.tmpdir, interval=0)
+        watcher.inotify = None
+        arguments = restretto.cli.parser.parse_args([self.tmpdir, '--watch'])
+        with mock.patch.object(watcher, 'wait', wait), \
+                mock.patch.object(watch, 'run_sessions', run_sessions), \
+                mock.patch('sys.stdout', io.StringIO()):
+            self.assertEqual(watch.watch(arguments, watcher), 0)
+        return runs
+
+    def test_reruns_changed(self):
+        path = os.path.join(self.tmpdir, 'two.yml')
+        runs = self.run_watch(
+            lambda: self.write('vars.yml', 'v: 10\n'),
+            # touched, but unchanged
+            lambda: os.utime(path, ns=(0, 0)),
+            lambda: self.write('three.yml', 'title: three\nbaseUri: ' + self.baseUri + '\nresources: [/get]\n'),
+            lambda: os.remove(path),
+        )
+        self.assertEqual(runs, [['one', 'two'], ['one'], ['three']])
+
+    def test_parse_errors(self):
+        runs = self.run_watch(
+            lambda: self.write('vars.yml', 'v: [\n'),
+            lambda: self.write('vars.yml', 'v: 3\n'),
+        )
+        self.assertEqual(runs, [['one', 'two'], ['one']])
+
+
+class PoolsTestCase(LocalServerMixin, unittest.TestCase):
+
+    def setUp(self):
+        self.registry = restretto.pools.configure(max_connections=4)
+
+    def tearDown(self):
+        restretto.pools.configure()
+
+    def test_shared_between_sessions(self):
+        first = self.session(['/get'], headers={'X-Session': 'first'})
+        second = self.session(['/get'], headers={'X-Session': 'second'}, keep_bodies=True)
+        first.http.cookies.set('token', 'first')
+        for session in (first, second):
+            session.test(session.resources[0])
+        self.assertIs(first.http.get_adapter(self.baseUri), second.http.get_adapter(self.baseUri))
+        self.assertEqual(self.registry.pool(self.baseUri, first.http).num_connections, 1)
+        # headers and cookies are not shared
+        headers = second.resources[0].response.json()['headers']
+        self.assertEqual(headers['X-Session'], 'second')
+        self.assertNotIn('Cookie', headers)
+
+    def test_prewarm(self):
+        session = self.session(['/get'])
+        self.assertEqual(self.registry.prewarm(self.baseUri, session.http, 10), 4)
+        pool = self.registry.pool(self.baseUri, session.http)
+        self.assertEqual(pool.num_connections, 4)
+        session.test(session.resources[0])
+        self.assertEqual(pool.num_connections, 4)
+
+    def test_no_keep_alive(self):
+        restretto.pools.configure(keep_alive=False)
+        session = self.session(['/get'])
+        self.assertEqual(session.http.headers['Connection'], 'close')
+
+
+class SkipBodyTestCase(LocalServerMixin, unittest.TestCase):
+
+    def setUp(self):
+        self.registry = restretto.pools.configure()
+        self.addCleanup(restretto.pools.configure)
+
+    def run_counting_connects(self, session):
+        """Test session resources, returns number of connections opened"""
+        from urllib3.connection import HTTPConnection
+        with mock.patch.object(HTTPConnection, 'connect', autospec=True, side_effect=HTTPConnection.connect) as connect:
+            for resource in session.resources:
+                session.test(resource)
+                self.assertEqual(resource.response.content, b'')
+        return connect.call_count
+
+    def test_body_used(self):
+        session = self.session([
+            {'get': '/get', 'vars': {'type': 'headers.Content-Type'}, 'expect': [{'status': 200}, {'header': 'Content-Type'}]},
+            {'get': '/get', 'vars': {'v': 'json.args.v'}},
+            {'get': '/get', 'expect': [{'body': 'text', 'contains': 'args'}]},
+            {'get': '/get', 'download': 'body.json'},
+        ])
+        self.assertEqual([r.skip_body for r in session.resources], [True, False, False, False])
+        bracketed = self.session([{'get': '/get?v=1', 'vars': {'v': 'json[args].v'}}])
+        self.assertFalse(bracketed.resources[0].skip_body)
+        bracketed.test(bracketed.resources[0])
+        self.assertEqual(bracketed.context['v'], '1')
+        kept = self.session(['/get'], keep_bodies=True)
+        self.assertFalse(kept.resources[0].skip_body)
+
+    def test_short_body_drained(self):
+        session = self.session([{'get': '/get', 'vars': {'type': 'headers.Content-Type'}}] * 2)
+        self.assertEqual(self.run_counting_connects(session), 1)
+        self.assertEqual(session.context['type'], 'application/json')
+
+    def test_short_chunked_body_drained(self):
+        session = self.session([{'get': '/chunked/10000'}] * 2)
+        self.assertEqual(self.run_counting_connects(session), 1)
+
+    def test_long_chunked_body_closed(self):
+        session = self.session([{'get': '/chunked/{}'.format(restretto.rest.DRAIN_LIMIT * 2)}] * 2)
+        self.assertEqual(self.run_counting_connects(session), 2)
+
+    def test_long_body_closed(self):
+        data = 'x' * (restretto.rest.DRAIN_LIMIT + 1)
+        session = self.session([{'post': '/post', 'data': data, 'expect': [{'status': 200}]}] * 2)
+        self.assertEqual(self.run_counting_connects(session), 2)
+
+
+class LowMemoryTestCase(LocalServerMixin, unittest.TestCase):
+
+    def test_summary(self):
+        session = self.session([
+            {'get': '/get?v=1', 'vars': {'v': 'json.args.v'}},
+            {'post': '/post', 'data': 'x' * 5000, 'expect': [{'status': 201}]},
+        ], low_memory=True, keep_bodies=True)
+        passed = session.test(session.resources[0])
+        self.assertIsInstance(passed.response, restretto.rest.ResponseSummary)
+        self.assertEqual(session.context['v'], '1')
+        self.assertEqual(passed.response.headers['Content-Type'], 'application/json')
+        self.assertIsNone(passed.response.excerpt)
+        with self.assertRaises(restretto.errors.ExpectError):
+            session.test(session.resources[1])
+        failed = session.resources[1].response
+        self.assertEqual(failed.status_code, 200)
+        self.assertTrue(failed.text.startswith('{"args"'))
+        self.assertIn('bytes more>', failed.text)
+        self.assertLess(len(failed.text), 2100)
+
+    def test_failed_streamed_download(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, 'body')
+        session = self.session([
+            {'post': '/post', 'data': 'x' * 100000, 'download': path, 'expect': [{'status': 201}]},
+        ], low_memory=True)
+        resource = session.resources[0]
+        self.assertTrue(resource.stream)
+        with mock.patch('requests.models.Response.content', new_callable=mock.PropertyMock) as content:
+            with self.assertRaises(restretto.errors.ExpectError):
+                session.test(resource)
+        # body is not read as a whole
+        content.assert_not_called()
+        summary = resource.response
+        self.assertIsNone(summary.size)
+        self.assertTrue(summary.text.startswith('{"args"'))
+        self.assertTrue(summary.text.endswith('<rest of body not read>'))
+        self.assertFalse(os.path.exists(path))
+
+    def test_cli(self):
+        self.addCleanup(restretto.rest.set_low_memory, False)
+        self.addCleanup(restretto.rest.set_keep_bodies, False)
+        resources = [{'get': '/get?v=passed'}, {'get': '/get?v=failed', 'expect': [{'status': 500}]}]
+        (code, output) = self.run_cli(lambda: [self.session(resources)], '--low-memory', '--print-response')
+        self.assertIn('"v": "failed"', output)
+        self.assertNotIn('"v": "passed"', output)
+        self.assertIn('bytes released>', output)
+
+
+class CassetteTestCase(LocalServerMixin, unittest.TestCase):
+
+    RESOURCES = [
+        {'get': '/response-headers?Set-Cookie=token%3Done', 'expect': [{'header': 'Set-Cookie'}]},
+        {'post': '/post', 'json': {'n': '{{n}}'}, 'vars': {'received': 'json.json.n'},
+         'expect': [{'body': 'json', 'property': 'json.json.n', 'is': '{{n}}'}]},
+        {'get': '/status/404', 'expect': [{'status': 404}]},
+        {'get': '/get?v={{received}}', 'expect': [{'body': 'json', 'property': 'json.args.v', 'is': '2'}]},
+    ]
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.addCleanup(restretto.pools.configure)
+        self.path = os.path.join(self.tmp.name, 'cassette')
+
+    def run_session(self, mode, n=2):
+        from restretto.cassette import Cassette
+        cassette = Cassette(self.path, mode)
+        restretto.pools.configure(cassette=cassette)
+        session = self.session(self.RESOURCES, vars={'n': n})
+        try:
+            for resource in session.resources:
+                session.test(resource)
+        finally:
+            cassette.close()
+        return session
+
+    def test_replay(self):
+        self.run_session('record')
+        with mock.patch('requests.adapters.HTTPAdapter.send', side_effect=AssertionError('network used')):
+            session = self.run_session('replay')
+        self.assertEqual(session.context['received'], 2)
+        self.assertEqual(session.http.cookies['token'], 'one')
+        self.assertEqual(session.resources[2].response.status_code, 404)
+
+    def test_not_recorded(self):
+        self.run_session('record')
+        with self.assertRaisesRegex(Exception, 'No recorded response for POST'):
+            self.run_session('replay', n=3)
+
+    def test_incomplete(self):
+        with open(self.path, 'wb') as target:
+            target.write(b'garbage')
+        from restretto.cassette import Cassette
+        with self.assertRaises(restretto.errors.ParseError):
+            Cassette(self.path, 'replay')
+
+    def test_cli(self):
+        for mode in ('--record', '--replay'):
+            # sessions are created after pools are configured
+            (code, output) = self.run_cli(lambda: [self.session(self.RESOURCES, vars={'n': 2})], mode, self.path)
+            self.assertEqual(code, 0)
+            self.assertIn('Total: 4 / Passed: 4', output)
+
+
+class ProfileTestCase(LocalServerMixin, unittest.TestCase):
+
+    RESOURCES = [
+        {'get': '/get?v=1', 'vars': {'v': 'json.args.v'}, 'expect': [{'body': 'json', 'property': 'json.args.v', 'is': '1'}]},
+        {'get': '/get?v={{v}}', 'expect': [{'status': 200}]},
+    ]
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def sessions(self):
+        return [self.session(self.RESOURCES, title='first'), self.session(self.RESOURCES, title='second')]
+
+    def run_profiled(self, *args):
+        (code, output) = self.run_cli(self.sessions, '--profile', self.tmp.name, *args)
+        self.assertEqual(code, 0)
+        return output
+
+    def test_profile(self):
+        import pstats
+        output = self.run_profiled()
+        for phase in ('load', 'templating', 'ttfb', 'http', 'json decoding', 'assertions'):
+            self.assertRegex(output, r'\n{} +\d+\.\d+ +\d+\.\d%'.format(phase))
+        stats = pstats.Stats(os.path.join(self.tmp.name, 'run.pstats'))
+        self.assertTrue(any(name == 'send' for (filename, line, name) in stats.stats))
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(self.tmp.name, 'sessions'))), ['001-first.pstats', '002-second.pstats']
+        )
+        with open(os.path.join(self.tmp.name, 'run.collapsed')) as source:
+            for line in source:
+                self.assertRegex(line, r'^\S.*;.* \d+$')
+
+    def test_profile_jobs(self):
+        self.run_profiled('-j', '2')
+        sessions = os.path.join(self.tmp.name, 'sessions')
+        if restretto.profile.SHARED_PROFILER:
+            self.assertFalse(os.path.exists(sessions))
+        else:
+            self.assertEqual(len(os.listdir(sessions)), 2)
+
+    def test_profile_jobs_shared_profiler(self):
+        with mock.patch.object(restretto.profile, 'SHARED_PROFILER', True):
+            self.run_profiled('-j', '2')
+        self.assertFalse(os.path.exists(os.path.join(self.tmp.name, 'sessions')))
+        self.assertTrue(os.path.exists(os.path.join(self.tmp.name, 'run.pstats')))
+
+
+class MetricsTestCase(LocalServerMixin, unittest.TestCase):
+
+    RESOURCES = [
+        {'get': '/status/200', 'title': 'health "check"'},
+        {'get': '/status/500', 'expect': [{'status': 200}]},
+    ]
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def test_exposition(self):
+        from restretto.metrics import Metrics
+        metrics = Metrics(buckets=(0.1, 1.0))
+        resources = self.RESOURCES + [{'get': '/get?token={{token}}'}, {'wait': 0}]
+        session = self.session(resources, title='probe', vars={'token': 'secret'})
+        for i in range(2):
+            for resource in session.resources:
+                try:
+                    session.test(resource)
+                    outcome = 0
+                except restretto.errors.ExpectError:
+                    outcome = 1
+                metrics.record(session.title, resource, outcome)
+        text = metrics.exposition()
+        self.assertTrue(text.endswith('# EOF\n'))
+        self.assertIn('restretto_request_duration_seconds_bucket{session="probe",resource="health \\"check\\"",le="+Inf"} 2', text)
+        self.assertIn('restretto_request_duration_seconds_count{session="probe",resource="health \\"check\\""} 2', text)
+        self.assertIn('restretto_responses_total{session="probe",resource="get /status/500",code="500"} 2', text)
+        self.assertIn('restretto_results_total{session="probe",resource="get /status/500",outcome="failed"} 2', text)
+        # labels are made of request before templating, waits are skipped
+        self.assertIn('resource="get /get?token={{token}}"', text)
+        self.assertNotIn('secret', text)
+        self.assertNotIn('Waiting', text)
+
+    def test_cli(self):
+        path = os.path.join(self.tmp.name, 'restretto.prom')
+        self.addCleanup(setattr, restretto.metrics, '_registry', None)
+        (code, output) = self.run_cli(lambda: [self.session(self.RESOURCES, title='probe')], '--metrics', path)
+        self.assertEqual(code, 1)
+        with open(path) as source:
+            text = source.read()
+        self.assertIn('outcome="passed"} 1', text)
+        self.assertEqual(os.listdir(self.tmp.name), ['restretto.prom'])
+
+    def test_serve(self):
+        import requests
+        from restretto.metrics import CONTENT_TYPE, Metrics
+        server = Metrics().serve(0)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+        response = requests.get(url + '/metrics')
+        self.assertEqual(response.headers['Content-Type'], CONTENT_TYPE)
+        self.assertTrue(response.text.endswith('# EOF\n'))
+        self.assertEqual(requests.get(url + '/other').status_code, 404)
+
+
+class HistogramTestCase(unittest.TestCase):
+
+    def test_percentiles(self):
+        histogram = restretto.stats.Histogram()
+        for i in range(1, 1001):
+            histogram.record(i / 1000.0)
+        self.assertEqual(histogram.count, 1000)
+        self.assertAlmostEqual(histogram.percentile(50), 0.5, delta=0.5 * 0.01)
+        self.assertAlmostEqual(histogram.percentile(99), 0.99, delta=0.99 * 0.01)
+        self.assertEqual(histogram.percentile(100), 1.0)
+        self.assertEqual(histogram.min, 0.001)
+        self.assertLess(len(histogram.buckets), 1000)
+
+    def test_merge(self):
+        first, second = restretto.stats.Histogram(), restretto.stats.Histogram()
+        first.record(0.1)
+        second.record(0.3)
+        first.merge(second)
+        self.assertEqual((first.count, first.min, first.max), (2, 0.1, 0.3))
+        self.assertAlmostEqual(first.mean, 0.2)
+
+    def test_cumulative(self):
+        histogram = restretto.stats.Histogram()
+        for value in (0.001, 0.02, 0.02, 0.3):
+            histogram.record(value)
+        self.assertEqual(histogram.cumulative([0.01, 0.1, 0.25, 1.0]), [1, 3, 3, 4])
+
+    def test_empty(self):
+        self.assertIsNone(restretto.stats.Histogram().percentile(50))
+
+
+class BenchTestCase(LocalServerMixin, unittest.TestCase):
+
+    RESOURCES = [
+        {'title': 'login', 'post': '/post', 'json': {'user': '{{user}}'},
+         'vars': {'token': 'json.json.user'}},
+        {'title': 'profile', 'get': '/get?token={{token}}',
+         'expect': [{'body': 'json', 'property': 'json.args.token', 'is': '{{user}}'}]},
+        {'wait': 0},
+        {'title': 'missing', 'get': '/status/404'},
+    ]
+
+    def test_bench_iterations(self):
+        import restretto.bench
+        session = self.session(self.RESOURCES, vars={'user': 'bob'})
+        (elapsed, stats) = restretto.bench.bench(session, concurrency=3, iterations=7)
+        self.assertEqual([s.title for s in stats], ['login', 'profile', 'missing'])
+        self.assertEqual([s.count for s in stats], [7, 7, 7])
+        self.assertEqual(stats[1].passed, 7)
+        self.assertEqual(stats[2].error_rate, 1.0)
+        self.assertIsNotNone(stats[0].latency.percentile(99))
+
+    def test_bench_cli(self):
+        self.addCleanup(restretto.pools.configure)
+        out = io.StringIO()
+        # sessions are created after pools are configured
+        load = lambda *args: [self.session(self.RESOURCES[:2], vars={'user': 'bob'})]
+        with mock.patch('restretto.bench.load', side_effect=load), \
+                mock.patch('sys.stdout', out):
+            code = restretto.cli.main(['bench', 'path', '-c', '30', '--duration', '0.2'])
+        self.assertEqual(code, 0)
+        self.assertEqual(restretto.pools.registry().max_connections, 30)
+        self.assertIn('p99 ms', out.getvalue())
+        self.assertIn('profile', out.getvalue())
+
+
+class AsyncEngineTestCase(LocalServerMixin, unittest.TestCase):
+
+    RESOURCES = [
+        {'get': '/get?a={{value}}', 'vars': {'received': 'json.args.a'}},
+        {'post': '/post', 'json': {'b': '{{received}}'},
+         'expect': [{'body': 'json', 'property': 'json.json.b', 'is': 'one'}]},
+        {'wait': 0},
+        {'get': '/status/404', 'expect': [{'status': '4xx'}]},
+        {'get': '/status/500', 'title': 'failing'},
+    ]
+
+    def setUp(self):
+        try:
+            import aiohttp  # noqa
+        except ImportError:
+            self.skipTest('aiohttp is not installed')
+
+    def sessions(self, resources=None):
+        return [self.session(resources or self.RESOURCES, vars={'value': 'one'}) for i in range(3)]
+
+    def test_cookies_of_ip_host(self):
+        resources = [
+            {'get': '/response-headers?Set-Cookie=token%3Done'},
+            {'get': '/get', 'vars': {'cookie': 'json.headers.Cookie'}},
+        ]
+        sessions = self.sessions(resources)
+        (code, output) = self.run_cli(lambda: sessions, '--engine', 'async')
+        self.assertEqual(code, 0, output)
+        self.assertEqual(sessions[0].context['cookie'], 'token=one')
+
+    def test_params_match_sync(self):
+        resources = [
+            {'get': '/get', 'params': {'debug': True, 'skip': None, 'ids': [1, 2], 'n': 1.5},
+             'vars': {'url': 'json.url'}},
+        ]
+        (sync_sessions, sessions) = (self.sessions(resources), self.sessions(resources))
+        self.run_cli(lambda: sync_sessions)
+        (async_code, async_out) = self.run_cli(lambda: sessions, '--engine', 'async')
+        self.assertEqual(async_code, 0, async_out)
+        self.assertEqual(sessions[0].context['url'], '/get?debug=True&ids=1&ids=2&n=1.5')
+        self.assertEqual(sessions[0].context['url'], sync_sessions[0].context['url'])
+
+    def test_async_engine_matches_sync(self):
+        sessions = self.sessions()
+        (sync_code, sync_out) = self.run_cli(self.sessions)
+        (async_code, async_out) = self.run_cli(lambda: sessions, '--engine', 'async', '-j', '3')
+        self.assertEqual(async_code, sync_code)
+        self.assertEqual(async_out, sync_out)
+        self.assertIn('Total: 15', async_out)
+        self.assertEqual(sessions[0].context['received'], 'one')
+
+
+class LazyImportsTestCase(unittest.TestCase):
+
+    def imported(self, statement):
+        code = "import sys; {}; print(' '.join(sorted(sys.modules)))".format(statement)
+        output = subprocess.check_output([sys.executable, '-c', code], universal_newlines=True)
+        return set(output.split())
+
+    def test_cli_import_is_light(self):
+        modules = self.imported('import restretto.cli')
+        for heavy in ('requests', 'yaml', 'jinja2', 'clint', 'asyncio', 'restretto.rest', 'cProfile'):
+            self.assertNotIn(heavy, modules)
+
+    def test_lazy_package_attributes(self):
+        self.assertNotIn('requests', self.imported('import restretto'))
+        self.assertIn('restretto.rest', self.imported('import restretto; restretto.Session'))
+        self.assertIs(restretto.load, restretto.loader.load)
+
+
 if __name__ == "__main__":
     unittest.main()